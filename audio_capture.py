@@ -0,0 +1,251 @@
+import threading
+
+import numpy as np
+
+from logger_setup import logger
+from vad import mean_square
+
+# Конфигурации потока в порядке предпочтения
+STREAM_CONFIGS = [
+    {'blocksize': 2048, 'latency': 'low'},
+    {'blocksize': 1024, 'latency': 'low'},
+]
+
+# Усиление в целочисленной арифметике: коэффициент в формате Q8
+GAIN_SHIFT = 8
+# Порог очень тихого звука (RMS в долях полной шкалы), шум не усиливаем
+QUIET_RMS = 0.001
+
+
+class BlockAmplifier:
+    """Усиливает блоки int16 без временных массивов.
+
+    Все вычисления идут в заранее выделенных буферах, поэтому в потоке
+    PortAudio память не выделяется. Усиление целочисленное (Q8) в int32,
+    энергия блока считается в float32, чтобы сумма квадратов
+    не переполнялась.
+    """
+
+    def __init__(self, max_frames=4096):
+        self._allocate(max_frames)
+
+    def _allocate(self, frames):
+        self.scratch = np.zeros(frames, dtype=np.int32)
+        self.energy_scratch = np.zeros(frames, dtype=np.float32)
+
+    def process(self, samples, amplification):
+        """Возвращает усиленный блок (вид на внутренний буфер)."""
+        frames = len(samples)
+        if frames > len(self.scratch):
+            self._allocate(frames)
+        block = self.scratch[:frames]
+
+        energy = mean_square(samples, self.energy_scratch)
+        if energy < (QUIET_RMS * 32768) ** 2 or amplification == 1.0:
+            # Шум не усиливаем
+            np.copyto(block, samples)
+            return block
+
+        gain = int(round(amplification * (1 << GAIN_SHIFT)))
+        np.multiply(samples, gain, out=block, dtype=np.int32)
+        np.right_shift(block, GAIN_SHIFT, out=block)
+        # minimum/maximum с out заметно быстрее np.clip
+        np.minimum(block, 32767, out=block)
+        np.maximum(block, -32768, out=block)
+        return block
+
+
+class AudioRingBuffer:
+    """Предвыделенный кольцевой буфер отсчётов int16.
+
+    Писатель (поток PortAudio) только копирует данные в буфер; читатель
+    ждёт данных на условной переменной. При переполнении теряются самые
+    старые отсчёты, счётчик overflows растёт.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.buffer = np.zeros(self.capacity, dtype=np.int16)
+        self.write_pos = 0
+        self.read_pos = 0
+        self.overflows = 0
+        self.woken = False
+        self.cond = threading.Condition()
+
+    def write(self, samples):
+        frames = len(samples)
+        if frames > self.capacity:
+            samples = samples[-self.capacity:]
+            frames = self.capacity
+        with self.cond:
+            start = self.write_pos % self.capacity
+            first = min(frames, self.capacity - start)
+            np.copyto(
+                self.buffer[start:start + first], samples[:first],
+                casting="unsafe"
+            )
+            if first < frames:
+                np.copyto(
+                    self.buffer[:frames - first], samples[first:],
+                    casting="unsafe"
+                )
+            self.write_pos += frames
+            if self.write_pos - self.read_pos > self.capacity:
+                self.read_pos = self.write_pos - self.capacity
+                self.overflows += 1
+            self.cond.notify()
+
+    def read(self, max_frames, timeout=None):
+        """Ждёт данных и возвращает до max_frames отсчётов в bytes.
+
+        Возвращает None по таймауту или после wake().
+        """
+        with self.cond:
+            self.cond.wait_for(
+                lambda: self.write_pos > self.read_pos or self.woken,
+                timeout,
+            )
+            self.woken = False
+            frames = min(self.write_pos - self.read_pos, max_frames)
+            if frames <= 0:
+                return None
+            start = self.read_pos % self.capacity
+            first = min(frames, self.capacity - start)
+            data = self.buffer[start:start + first].tobytes()
+            if first < frames:
+                data += self.buffer[:frames - first].tobytes()
+            self.read_pos += frames
+            return data
+
+    def keep_last(self, frames):
+        """Отбрасывает всё, кроме последних frames отсчётов."""
+        with self.cond:
+            self.read_pos = max(self.read_pos, self.write_pos - int(frames))
+            self.woken = False
+
+    def wake(self):
+        with self.cond:
+            self.woken = True
+            self.cond.notify_all()
+
+
+class AudioCapture:
+    """Сессия захвата: поток, усиление и буфер одного микрофона.
+
+    Всё состояние захвата принадлежит экземпляру, поэтому в одном
+    процессе могут работать несколько независимых сессий (например,
+    два микрофона). Поток открывается один раз и работает постоянно,
+    блоки пишутся в ограниченный кольцевой буфер. Пока фраза не
+    записывается, читатель не продвигается, и при начале фразы из
+    буфера остаются последние preroll_seconds секунд, поэтому начало
+    речи не обрезается.
+    """
+
+    def __init__(self, device_index, sample_rate, amplification=1.0,
+                 preroll_seconds=0.5, buffer_seconds=30.0):
+        self.device_index = device_index
+        self.sample_rate = sample_rate
+        self.amplification = 1.0
+        self.set_amplification(amplification)
+        self.preroll_frames = int(preroll_seconds * sample_rate)
+        self.ring = AudioRingBuffer(int(buffer_seconds * sample_rate))
+        self.amplifier = BlockAmplifier()
+        self.status_count = 0
+        self.overflows_at_start = 0
+        self.stream = None
+
+    def _callback(self, indata, frames, time_, status):
+        if status:
+            self.status_count += 1
+            logger.warning(f"Audio callback status: {status}")
+
+        try:
+            block = self.amplifier.process(
+                indata[:, 0], self.amplification
+            )
+        except Exception as e:
+            logger.error(f"Ошибка в audio_callback: {e}")
+            # В случае ошибки передаем оригинальные данные
+            block = indata[:, 0]
+        self.ring.write(block)
+
+    def set_amplification(self, factor):
+        self.amplification = max(1.0, min(5.0, float(factor)))
+        logger.info(
+            f"Установлено усиление микрофона: {self.amplification:.1f}"
+        )
+
+    def _open_stream(self, **kwargs):
+        # PortAudio нужен только для потока: буфер и усилитель
+        # (benchmarks.py audio) работают и без него
+        import sounddevice as sd
+        from audio_utils import open_stream
+
+        return open_stream(
+            sd.InputStream,
+            samplerate=self.sample_rate,
+            dtype="int16",
+            channels=1,
+            callback=self._callback,
+            device=self.device_index,
+            **kwargs
+        )
+
+    def start(self):
+        """Запускает поток, если он ещё не запущен."""
+        if self.stream is not None:
+            return True
+
+        for config in STREAM_CONFIGS:
+            try:
+                self.stream = self._open_stream(**config)
+                logger.info(
+                    f"Аудиопоток запущен: blocksize={config['blocksize']}"
+                )
+                return True
+            except Exception as e:
+                logger.debug(f"Ошибка конфигурации {config}: {e}")
+
+        # Последняя попытка с базовыми настройками
+        try:
+            self.stream = self._open_stream()
+            logger.info("Аудиопоток запущен с настройками по умолчанию")
+            return True
+        except Exception as e:
+            logger.error(f"Не удалось запустить аудиопоток: {e}")
+            return False
+
+    def begin_utterance(self):
+        """Начинает фразу: сбрасывает старые блоки, оставляя предзапись."""
+        self.ring.keep_last(self.preroll_frames)
+        self.status_count = 0
+        # Вне фразы читатель стоит, поэтому считаем только новые переполнения
+        self.overflows_at_start = self.ring.overflows
+
+    def read(self, timeout=None, max_frames=4096):
+        """Возвращает следующий кусок аудио в bytes или None."""
+        return self.ring.read(max_frames, timeout)
+
+    def wake(self):
+        """Будит читателя, ожидающего данных."""
+        self.ring.wake()
+
+    def end_utterance(self):
+        overflows = self.ring.overflows - self.overflows_at_start
+        if self.status_count or overflows:
+            logger.info(
+                f"Предупреждений аудиопотока: {self.status_count}, "
+                f"переполнений буфера: {overflows}"
+            )
+
+    def close(self):
+        """Останавливает и закрывает поток."""
+        if self.stream is None:
+            return
+        from audio_utils import close_stream
+
+        try:
+            close_stream(self.stream)
+        except Exception as e:
+            logger.debug(f"Ошибка закрытия аудиопотока: {e}")
+        self.stream = None
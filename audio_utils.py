@@ -1,83 +1,161 @@
+import json
 import numpy as np
+import os
 import sounddevice as sd
+import threading
 import time
+from calibration import analyze_calibration_recording, analyze_wav
+from contextlib import contextmanager
 from logger_setup import logger
-from utils import dev_to_str_dict, test_microphone_sensitivity
+from utils import dev_to_str_dict
 
 # Глобальные переменные для калибровки
 calibrated_amplification = 3.0
 calibrated_silence_threshold = 0.01
 
+# Выбранный микрофон и результаты калибровки между запусками
+MICROPHONE_CACHE_FILE = "microphone_cache.json"
+
+# Открытие и закрытие потоков PortAudio не потокобезопасны ни в одном
+# host API: все они идут под одним замком. Сколько ждать замок или
+# зависший вызов, прежде чем считать устройство неработающим
+PORTAUDIO_TIMEOUT = 5.0
+portaudio_lock = threading.Lock()
+# Потоки опроса, брошенные по таймауту: возможно, ещё внутри PortAudio
+abandoned_threads = []
+
+
+@contextmanager
+def portaudio_access(timeout=PORTAUDIO_TIMEOUT):
+    """Единоличный доступ к PortAudio для открытия/закрытия потока.
+
+    Пока жив брошенный поток опроса, новые вызовы PortAudio не
+    делаются: через timeout выбрасывается TimeoutError.
+    """
+    deadline = time.monotonic() + timeout
+    for thread in list(abandoned_threads):
+        thread.join(max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            raise TimeoutError(f"PortAudio занят зависшим {thread.name}")
+        abandoned_threads.remove(thread)
+    if not portaudio_lock.acquire(
+            timeout=max(0.0, deadline - time.monotonic())):
+        raise TimeoutError("PortAudio занят другим потоком")
+    try:
+        yield
+    finally:
+        portaudio_lock.release()
 
-def calibrate_microphone(device_index, sample_rate, calibration_time=3.0):
-    """Улучшенная калибровка микрофона."""
+
+def portaudio_stuck():
+    """Жив ли хотя бы один брошенный поток опроса."""
+    return any(thread.is_alive() for thread in abandoned_threads)
+
+
+def open_stream(stream_class, **kwargs):
+    """Создаёт и запускает поток sounddevice под замком PortAudio."""
+    with portaudio_access():
+        stream = stream_class(**kwargs)
+        try:
+            stream.start()
+        except Exception:
+            stream.close()
+            raise
+    return stream
+
+
+def close_stream(stream):
+    """Останавливает и закрывает поток под замком PortAudio."""
+    with portaudio_access():
+        stream.close()
+
+
+def run_with_timeout(function, timeout, *args):
+    """Вызывает function(*args) в отдельном потоке и ждёт не дольше
+    timeout. Если поток не успел, он запоминается в abandoned_threads
+    и выбрасывается TimeoutError."""
+    result = {}
+
+    def target():
+        try:
+            result["value"] = function(*args)
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(
+        target=target, name=f"probe-{function.__name__}", daemon=True
+    )
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        abandoned_threads.append(thread)
+        raise TimeoutError(f"{function.__name__}{args} не ответил")
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+def apply_calibration(analysis):
+    """Сохраняет результат анализа в глобальные параметры калибровки."""
     global calibrated_amplification, calibrated_silence_threshold
 
+    calibrated_amplification = analysis["amplification"]
+    calibrated_silence_threshold = analysis["silence_threshold"]
+    logger.info(
+        f"Уровень фонового шума: {analysis['noise_rms']:.6f}, "
+        f"RMS речи: {analysis['speech_rms']:.6f}, "
+        f"пик речи: {analysis['speech_peak']:.4f}"
+    )
+    logger.info(
+        f"Установлен порог тишины: {calibrated_silence_threshold:.6f}"
+    )
+    logger.info(f"Оптимальное усиление: {calibrated_amplification:.2f}")
+    return calibrated_amplification, calibrated_silence_threshold
+
+
+def calibrate_from_wav(path):
+    """Калибровка по готовой записи, без микрофона."""
+    return apply_calibration(analyze_wav(path))
+
+
+def calibrate_microphone(device_index, sample_rate, calibration_time=3.0):
+    """Калибровка микрофона по одной короткой записи.
+
+    Пользователь произносит фразу во время записи; паузы между словами
+    дают уровень шума, громкие кадры — уровень речи. Возвращает
+    (усиление, порог) или None, если запись не удалась или речи в ней
+    не было (тогда остаются прежние параметры).
+    """
     logger.info("Начинаем калибровку микрофона...")
 
     try:
-        # Записываем фоновый шум
-        logger.info("Записываем фоновый шум...")
-        noise_recording = sd.rec(
-            int(calibration_time * sample_rate),
+        logger.info("Произнесите тестовую фразу для калибровки...")
+        stream = open_stream(
+            sd.InputStream,
             samplerate=sample_rate,
             channels=1,
             device=device_index,
             dtype='float32'
         )
-        sd.wait()
-
-        if noise_recording.size > 0:
-            noise_rms = np.sqrt(np.mean(noise_recording**2))
-            logger.info(f"Уровень фонового шума: {noise_rms:.6f}")
-
-            # Более агрессивный порог для лучшего распознавания
-            # Увеличили множитель
-            calibrated_silence_threshold = max(0.01, noise_rms * 5)
-            logger.info(
-                f"Установлен порог тишины: {calibrated_silence_threshold:.6f}"
-            )
-
-        # Тестируем уровни усиления с голосом
-        logger.info("Произнесите тестовую фразу для калибровки...")
-        time.sleep(1)  # Даем время подготовиться
-
-        test_amplifications = [1.0, 2.0, 3.0, 4.0]
-        best_amplification = 2.0
-        best_level = 0.0
-
-        for amp in test_amplifications:
-            logger.info(f"Тестируем усиление {amp}...")
-            time.sleep(1)  # Пауза для произнесения фразы
-
-            test_recording = sd.rec(
-                int(2.0 * sample_rate),  # Увеличили время записи
-                samplerate=sample_rate,
-                channels=1,
-                device=device_index,
-                dtype='float32'
-            )
-            sd.wait()
-
-            if test_recording.size > 0:
-                amplified = test_recording * amp
-                level = np.sqrt(np.mean(amplified**2))
+        try:
+            recording, _ = stream.read(int(calibration_time * sample_rate))
+        finally:
+            close_stream(stream)
 
-                logger.info(f"Уровень при усилении {amp}: {level:.6f}")
-
-                # Ищем оптимальное усиление (более строгие критерии)
-                if 0.05 < level < 0.7 and level > best_level:
-                    best_level = level
-                    best_amplification = amp
-
-        calibrated_amplification = best_amplification
-        logger.info(f"Оптимальное усиление: {calibrated_amplification:.1f}")
-
-        return calibrated_amplification, calibrated_silence_threshold
+        start_time = time.perf_counter()
+        analysis = analyze_calibration_recording(recording, sample_rate)
+        logger.debug(
+            f"Анализ калибровки занял "
+            f"{(time.perf_counter() - start_time) * 1000:.1f} мс"
+        )
+        if analysis["speech_ratio"] == 0:
+            logger.warning("Речь при калибровке не обнаружена")
+            return None
+        return apply_calibration(analysis)
 
     except Exception as e:
         logger.error(f"Ошибка калибровки: {e}")
-        return 3.0, 0.01
+        return None
 
 
 def get_calibrated_amplification():
@@ -96,14 +174,18 @@ def test_microphone(device_index, sample_rate, duration=0.5):
         device_index = int(device_index)
         sample_rate = int(sample_rate)
 
-        with sd.InputStream(
+        stream = open_stream(
+            sd.InputStream,
             device=device_index,
             channels=1,
             samplerate=sample_rate,
             blocksize=1024,
             dtype='int16'
-        ):
-            sd.sleep(int(duration * 1000))
+        )
+        try:
+            time.sleep(duration)
+        finally:
+            close_stream(stream)
         return True
     except Exception as e:
         logger.debug(
@@ -123,62 +205,274 @@ def is_wdm_ks_device(device_name):
     )
 
 
-def auto_select_microphone(preferred_sample_rate=16000):
-    """Улучшенный выбор микрофона с обходом WDM-KS устройств."""
+def get_input_devices_signature(devices):
+    """Список входных устройств (имя, host API) для проверки изменений."""
+    signature = []
+    for dev in devices:
+        dev_dict = dev_to_str_dict(dev)
+        if int(dev_dict.get("max_input_channels", 0)) <= 0:
+            continue
+        signature.append([
+            dev_dict.get("name", "Unknown"),
+            get_hostapi_name(dev_dict.get("hostapi")),
+        ])
+    return signature
+
+
+def get_hostapi_name(hostapi_index):
     try:
-        devices = sd.query_devices()
-        working_devices = []
+        with portaudio_access():
+            return sd.query_hostapis(int(hostapi_index))["name"]
+    except Exception:
+        return ""
 
-        logger.info("Поиск рабочих микрофонов...")
 
-        for i, dev in enumerate(devices):
-            try:
-                dev_dict = dev_to_str_dict(dev)
-                max_input_channels = int(dev_dict.get("max_input_channels", 0))
+def load_microphone_cache(cache_path):
+    try:
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        logger.error(f"Ошибка загрузки кэша микрофона: {e}")
+    return None
 
-                if max_input_channels <= 0:
-                    continue
 
-                name = dev_dict.get("name", "Unknown")
-                default_rate = int(dev_dict.get("default_samplerate", 44100))
+def save_microphone_cache(cache_path, devices, device_index, sample_rate):
+    """Сохраняет выбранное устройство (по имени и host API) и калибровку."""
+    if not cache_path:
+        return
+    try:
+        dev_dict = dev_to_str_dict(devices[device_index])
+        cache = {
+            "name": dev_dict.get("name", "Unknown"),
+            "hostapi": get_hostapi_name(dev_dict.get("hostapi")),
+            "sample_rate": int(sample_rate),
+            "amplification": float(calibrated_amplification),
+            "silence_threshold": float(calibrated_silence_threshold),
+            "devices": get_input_devices_signature(devices),
+        }
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        logger.info(f"Выбор микрофона сохранён в {cache_path}")
+    except Exception as e:
+        logger.error(f"Ошибка сохранения кэша микрофона: {e}")
+
+
+def select_cached_microphone(devices, cache):
+    """Возвращает (индекс, частота) сохранённого микрофона или None.
+
+    Кэш действителен, если список входных устройств не изменился и
+    устройство открывается с сохранённой частотой (быстрая проверка
+    без записи).
+    """
+    if not cache:
+        return None
+    if cache.get("devices") != get_input_devices_signature(devices):
+        logger.info("Список устройств изменился, нужен полный поиск")
+        return None
+
+    for i, dev in enumerate(devices):
+        dev_dict = dev_to_str_dict(dev)
+        if (dev_dict.get("name") == cache["name"]
+                and get_hostapi_name(dev_dict.get("hostapi"))
+                == cache["hostapi"]):
+            if test_microphone(i, cache["sample_rate"], 0):
+                return i, cache["sample_rate"]
+            logger.info(f"Сохранённое устройство {cache['name']} не отвечает")
+            return None
+    return None
+
+
+def auto_select_microphone(preferred_sample_rate=16000,
+                           cache_path=MICROPHONE_CACHE_FILE,
+                           recalibrate=False):
+    """Выбор микрофона: из кэша прошлого запуска или полным поиском.
+
+    recalibrate=True принудительно запускает поиск и калибровку.
+    """
+    global calibrated_amplification, calibrated_silence_threshold
 
-                if is_wdm_ks_device(name):
-                    logger.debug(
-                        f"Пропущено WDM-KS устройство: {name} (индекс {i})"
-                    )
-                    continue
+    try:
+        with portaudio_access():
+            devices = sd.query_devices()
+    except Exception as e:
+        logger.error(f"Критическая ошибка выбора микрофона: {e}")
+        return 1, 16000
 
-                test_rates = [16000, 44100, 48000, 22050, 8000]
-
-                for test_rate in test_rates:
-                    if test_microphone(i, test_rate, 0.3):
-                        sensitivity_score = test_microphone_sensitivity(
-                            i,
-                            test_rate,
-                            0.5
-                        )
-
-                        working_devices.append({
-                            'index': i,
-                            'name': name,
-                            'sample_rate': test_rate,
-                            'sensitivity': sensitivity_score,
-                            'default_rate': default_rate
-                        })
-
-                        logger.info(
-                            f"Найдено рабочее устройство: {name} "
-                            f"(индекс {i}, {test_rate}Hz, "
-                            f"чувствительность: {sensitivity_score:.4f})"
-                        )
-                        break
+    if not recalibrate:
+        cache = load_microphone_cache(cache_path)
+        selected = select_cached_microphone(devices, cache)
+        if selected:
+            calibrated_amplification = cache["amplification"]
+            calibrated_silence_threshold = cache["silence_threshold"]
+            logger.info(
+                f"Используется сохранённый микрофон: {cache['name']} "
+                f"(индекс {selected[0]}, {selected[1]}Hz), "
+                f"калибровка пропущена"
+            )
+            return selected
 
-            except Exception:
-                logger.debug(f"Ошибка тестирования устройства {i}")
+    start_time = time.time()
+    device_index, sample_rate, reliable = scan_microphones(
+        devices, preferred_sample_rate
+    )
+    logger.info(
+        f"Поиск и калибровка микрофона заняли {time.time() - start_time:.1f} с"
+    )
+    # Запасной выбор и неудачную калибровку не запоминаем: следующий
+    # запуск должен искать заново, а не доверять им
+    if reliable:
+        save_microphone_cache(cache_path, devices, device_index, sample_rate)
+    return device_index, sample_rate
+
+
+def measure_microphone_rms(device_index, sample_rate, duration=0.5):
+    """RMS короткой записи через собственный поток устройства.
+
+    Открытие и закрытие идут под замком PortAudio, а запись — без него,
+    поэтому замеры разных устройств в probe_devices перекрываются.
+    """
+    try:
+        stream = open_stream(
+            sd.InputStream,
+            device=device_index,
+            channels=1,
+            samplerate=sample_rate,
+            dtype='float32'
+        )
+        try:
+            recording, _ = stream.read(int(duration * sample_rate))
+        finally:
+            close_stream(stream)
+        if recording.size > 0:
+            return float(np.sqrt(np.mean(recording**2)))
+        return 0.0
+    except Exception as e:
+        logger.debug(f"Ошибка тестирования чувствительности: {e}")
+        return 0.0
+
+
+def find_working_rate(device_index):
+    """Первая частота, с которой устройство открывается (без записи)."""
+    test_rates = [16000, 44100, 48000, 22050, 8000]
+    for test_rate in test_rates:
+        if test_microphone(device_index, test_rate, 0):
+            return test_rate
+    return None
+
+
+def probe_devices(devices, probe_timeout=PORTAUDIO_TIMEOUT):
+    """Опрос входных устройств: рабочая частота и чувствительность.
+
+    Все открытия и закрытия потоков идут по одному под замком
+    PortAudio, параллельно идут только сами замеры (0.5 с записи).
+    Проверка частот и замеры выполняются в отдельных потоках
+    с таймаутом: зависшее устройство прерывает опрос, а не загрузку,
+    и пока его поток жив, PortAudio больше не вызывается (см.
+    portaudio_access). Результат в порядке индексов устройств.
+    """
+    candidates = []
+    for i, dev in enumerate(devices):
+        try:
+            dev_dict = dev_to_str_dict(dev)
+            max_input_channels = int(dev_dict.get("max_input_channels", 0))
+
+            if max_input_channels <= 0:
+                continue
+
+            name = dev_dict.get("name", "Unknown")
+            default_rate = int(dev_dict.get("default_samplerate", 44100))
+
+            if is_wdm_ks_device(name):
+                logger.debug(
+                    f"Пропущено WDM-KS устройство: {name} (индекс {i})"
+                )
                 continue
 
+            test_rate = run_with_timeout(find_working_rate, probe_timeout, i)
+            if test_rate is None:
+                continue
+            candidates.append({
+                'index': i,
+                'name': name,
+                'sample_rate': test_rate,
+                'default_rate': default_rate,
+            })
+
+        except TimeoutError:
+            logger.warning(
+                f"Устройство {i} не ответило за {probe_timeout:.0f} с, "
+                f"опрос остановлен"
+            )
+            # Замерять нельзя: PortAudio занят зависшим вызовом
+            for candidate in candidates:
+                candidate['sensitivity'] = 0.0
+            return candidates
+        except Exception:
+            logger.debug(f"Ошибка тестирования устройства {i}")
+            continue
+
+    threads = []
+    results = {}
+    for candidate in candidates:
+        def measure(candidate=candidate):
+            results[candidate['index']] = measure_microphone_rms(
+                candidate['index'], candidate['sample_rate'], 0.5
+            )
+
+        thread = threading.Thread(
+            target=measure, name=f"probe-rms-{candidate['index']}",
+            daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+
+    # Открытия идут по очереди, поэтому срок растёт с числом устройств
+    deadline = time.monotonic() + probe_timeout + 0.1 * len(candidates)
+    for candidate, thread in zip(candidates, threads):
+        thread.join(max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            abandoned_threads.append(thread)
+            logger.warning(
+                f"Устройство {candidate['name']} не ответило "
+                f"за {probe_timeout:.0f} с"
+            )
+        candidate['sensitivity'] = results.get(candidate['index'], 0.0)
+        logger.info(
+            f"Найдено рабочее устройство: {candidate['name']} "
+            f"(индекс {candidate['index']}, "
+            f"{candidate['sample_rate']}Hz, "
+            f"чувствительность: {candidate['sensitivity']:.4f})"
+        )
+    return candidates
+
+
+def scan_microphones(devices, preferred_sample_rate=16000):
+    """Улучшенный выбор микрофона с обходом WDM-KS устройств.
+
+    Возвращает (индекс, частота, надёжно): надёжно=True, только если
+    устройство найдено опросом и калибровка прошла успешно.
+    """
+    try:
+        logger.info("Поиск рабочих микрофонов...")
+
+        start_time = time.time()
+        working_devices = probe_devices(devices)
+        logger.info(
+            f"Опрос устройств занял {time.time() - start_time:.2f} с"
+        )
         working_devices.sort(key=lambda x: x['sensitivity'], reverse=True)
 
+        if portaudio_stuck():
+            # Калибровка и запасные проверки упёрлись бы в таймаут
+            logger.error("PortAudio завис при опросе, калибровка пропущена")
+            if working_devices:
+                best_device = working_devices[0]
+                return (
+                    best_device['index'], best_device['sample_rate'], False
+                )
+            return 0, 44100, False
+
         if working_devices:
             best_device = working_devices[0]
             logger.info(
@@ -189,11 +483,14 @@ def auto_select_microphone(preferred_sample_rate=16000):
             )
 
             # Выполняем калибровку выбранного устройства
-            calibrate_microphone(
+            calibrated = calibrate_microphone(
                 best_device['index'], best_device['sample_rate']
             )
 
-            return best_device['index'], best_device['sample_rate']
+            return (
+                best_device['index'], best_device['sample_rate'],
+                calibrated is not None
+            )
 
         logger.warning(
             "Не найдено обычных устройств, пробуем любые доступные..."
@@ -209,29 +506,29 @@ def auto_select_microphone(preferred_sample_rate=16000):
                 name = dev_dict.get("name", "Unknown")
                 default_rate = int(dev_dict.get("default_samplerate", 44100))
 
-                if test_microphone(i, default_rate, 0.2):
+                if test_microphone(i, default_rate, 0):
                     logger.info(
                         f"Выбрано устройство как последний вариант: {name} "
                         f"(индекс {i}, {default_rate}Hz)"
                     )
 
                     calibrate_microphone(i, default_rate)
-                    return i, default_rate
+                    return i, default_rate, False
 
             except Exception:
                 continue
 
         logger.warning("Пробуем устройство 1 с 16000Hz как последний вариант")
-        if test_microphone(1, 16000, 0.2):
+        if test_microphone(1, 16000, 0):
             calibrate_microphone(1, 16000)
-            return 1, 16000
+            return 1, 16000, False
 
         logger.error(
             "Не найдено рабочих микрофонов, используется устройство 0"
         )
         calibrate_microphone(0, 44100)
-        return 0, 44100
+        return 0, 44100, False
 
     except Exception as e:
         logger.error(f"Критическая ошибка выбора микрофона: {e}")
-        return 1, 16000
+        return 1, 16000, False
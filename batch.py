@@ -0,0 +1,268 @@
+"""Пакетное распознавание и перевод WAV-файлов без GUI и микрофона.
+
+Пример:
+    python batch.py записи/ --input-lang ru --output-lang en \
+        --format jsonl srt --output results/ --workers 8 --ct2-threads 2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from logger_setup import logger
+from translation import Translator
+from utils import get_models_paths
+
+
+def find_wav_files(inputs):
+    """Находит WAV-файлы в переданных каталогах и файлах (рекурсивно)."""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for dirpath, _, filenames in os.walk(item):
+                files.extend(
+                    os.path.join(dirpath, name)
+                    for name in filenames
+                    if name.lower().endswith(".wav")
+                )
+        elif item.lower().endswith(".wav"):
+            files.append(item)
+        else:
+            logger.warning(f"Пропущен {item}: не WAV-файл и не каталог")
+    # Файл, указанный и сам, и через свой каталог, обрабатываем один раз
+    unique = {os.path.abspath(path): path for path in files}
+    return sorted(unique.values())
+
+
+def output_names(wav_files):
+    """Имена результатов без расширения для каждого файла.
+
+    Имя — путь файла относительно общего каталога всех входов, так что
+    a/call.wav и b/call.wav дают a/call и b/call, а не один call.
+    Если два файла всё же дают одно имя (например, call.wav и call.WAV),
+    выбрасывается ValueError, а не перезаписывается результат.
+    """
+    paths = [os.path.abspath(path) for path in wav_files]
+    try:
+        root = os.path.commonpath([os.path.dirname(p) for p in paths])
+    except ValueError:
+        # Файлы на разных дисках: общего каталога нет
+        root = None
+    names = {}
+    owners = {}
+    for wav_path, path in zip(wav_files, paths):
+        if root is None:
+            drive, rest = os.path.splitdrive(path)
+            relative = os.path.join(drive.strip(":\\/"), rest.lstrip("\\/"))
+        else:
+            relative = os.path.relpath(path, root)
+        name = os.path.splitext(relative)[0]
+        key = os.path.normcase(name).lower()
+        if key in owners:
+            raise ValueError(
+                f"{owners[key]} и {wav_path} дают один файл результата {name}"
+            )
+        owners[key] = wav_path
+        names[wav_path] = name
+    return names
+
+
+def format_srt_time(seconds):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+
+def write_srt(path, segments):
+    """Записывает перевод сегментов в формате SRT."""
+    previous_end = 0.0
+    with open(path, "w", encoding="utf-8") as f:
+        for number, segment in enumerate(segments, 1):
+            start = segment["start"]
+            if start is None:
+                start = previous_end
+            end = segment["end"]
+            if end is None:
+                end = start + 2.0
+            previous_end = end
+            f.write(
+                f"{number}\n"
+                f"{format_srt_time(start)} --> {format_srt_time(end)}\n"
+                f"{segment['translation']}\n\n"
+            )
+
+
+def output_path(output_dir, name, extension):
+    """Путь результата; подкаталоги повторяют структуру входов."""
+    path = os.path.join(output_dir, name + extension)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def process_file(translator, wav_path, input_lang, output_lang):
+    """Распознаёт и переводит один файл, возвращает список сегментов."""
+    segments = translator.recognize_file(wav_path, input_lang)
+    for segment in segments:
+        segment["file"] = wav_path
+        segment["translation"] = translator.translate_text(
+            segment["text"], input_lang, output_lang
+        )
+    return segments
+
+
+# Переводчик рабочего процесса: модели загружаются один раз на процесс
+_worker_translator = None
+_worker_langs = None
+
+
+def set_translation_threads(threads):
+    """Число потоков CTranslate2 на один перевод в этом процессе."""
+    import argostranslate.settings
+
+    os.environ["ARGOS_INTRA_THREADS"] = str(threads)
+    argostranslate.settings.intra_threads = threads
+    argostranslate.settings.inter_threads = 1
+
+
+def init_worker(input_lang, output_lang, ct2_threads):
+    global _worker_translator, _worker_langs
+
+    if ct2_threads:
+        set_translation_threads(ct2_threads)
+    _worker_translator = Translator(
+        get_models_paths(),
+        max_resident_models=1,
+        headless=True,
+    )
+    # Загружаем модель заранее, а не на первом файле
+    _worker_translator.set_language(input_lang)
+    _worker_langs = (input_lang, output_lang)
+    logger.info(f"Рабочий процесс {os.getpid()} готов")
+
+
+def process_file_in_worker(wav_path):
+    """Обрабатывает файл в рабочем процессе; ошибки возвращает строкой."""
+    try:
+        return wav_path, process_file(
+            _worker_translator, wav_path, *_worker_langs
+        ), None
+    except Exception as e:
+        return wav_path, None, str(e)
+
+
+def run_in_process(args, wav_files):
+    """Последовательная обработка в текущем процессе."""
+    if args.ct2_threads:
+        set_translation_threads(args.ct2_threads)
+    translator = Translator(
+        get_models_paths(),
+        cache_path=args.cache_file,
+        max_resident_models=1,
+        headless=True,
+    )
+    try:
+        for wav_path in wav_files:
+            try:
+                yield wav_path, process_file(
+                    translator, wav_path, args.input_lang, args.output_lang
+                ), None
+            except Exception as e:
+                yield wav_path, None, str(e)
+    finally:
+        translator.stop()
+
+
+def run_in_pool(args, wav_files):
+    """Параллельная обработка; результаты приходят в порядке файлов."""
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=init_worker,
+        initargs=(args.input_lang, args.output_lang, args.ct2_threads),
+    ) as executor:
+        yield from executor.map(process_file_in_worker, wav_files)
+
+
+def write_results(args, name, segments, jsonl_file):
+    if jsonl_file:
+        for segment in segments:
+            jsonl_file.write(json.dumps(segment, ensure_ascii=False) + "\n")
+    if "srt" in args.format:
+        write_srt(output_path(args.output, name, ".srt"), segments)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Пакетное распознавание и перевод WAV-файлов"
+    )
+    parser.add_argument("inputs", nargs="+", help="каталоги или WAV-файлы")
+    parser.add_argument("--input-lang", default="ru")
+    parser.add_argument("--output-lang", default="en")
+    parser.add_argument(
+        "--format", nargs="+", choices=["jsonl", "srt"], default=["jsonl"]
+    )
+    parser.add_argument("--output", default="batch_output")
+    parser.add_argument(
+        "--cache-file", default=None,
+        help="файл кэша переводов (только при --workers 1)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="число рабочих процессов (по умолчанию 1 — без пула)"
+    )
+    parser.add_argument(
+        "--ct2-threads", type=int, default=0,
+        help="потоков CTranslate2 на процесс (0 — по умолчанию Argos)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    wav_files = find_wav_files(args.inputs)
+    if not wav_files:
+        logger.error("WAV-файлы не найдены")
+        return 1
+    try:
+        names = output_names(wav_files)
+    except ValueError as e:
+        logger.error(f"Конфликт имён результатов: {e}")
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+
+    jsonl_file = None
+    if "jsonl" in args.format:
+        jsonl_file = open(
+            os.path.join(args.output, "results.jsonl"), "w", encoding="utf-8"
+        )
+
+    start_time = time.time()
+    failed = 0
+    if args.workers > 1:
+        results = run_in_pool(args, wav_files)
+    else:
+        results = run_in_process(args, wav_files)
+    try:
+        for wav_path, segments, error in results:
+            if error is not None:
+                failed += 1
+                logger.error(f"Ошибка обработки {wav_path}: {error}")
+                continue
+            write_results(args, names[wav_path], segments, jsonl_file)
+    finally:
+        if jsonl_file:
+            jsonl_file.close()
+
+    logger.info(
+        f"Обработано файлов: {len(wav_files) - failed} из {len(wav_files)} "
+        f"за {time.time() - start_time:.1f} с"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
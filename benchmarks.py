@@ -0,0 +1,208 @@
+"""Микробенчмарки горячих участков переводчика.
+
+Запуск: python benchmarks.py <имя> (без имени — все).
+"""
+import argparse
+import queue
+import time
+
+import numpy as np
+
+
+def legacy_amplify_block(indata, amplification):
+    """Прежний вариант audio_callback: ~6 временных массивов на блок."""
+    audio_float = indata.astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(audio_float**2))
+    if rms < 0.001:
+        amplified_audio = audio_float
+    else:
+        amplified_audio = audio_float * amplification
+    amplified_audio = np.clip(amplified_audio, -1.0, 1.0)
+    return bytes((amplified_audio * 32767).astype(np.int16))
+
+
+def best_per_call(function, calls, repeat):
+    """Время одного вызова function(i), с: лучший из repeat прогонов
+    по calls вызовов (минимум меньше всего зависит от фоновой нагрузки)."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(calls):
+            function(i)
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+
+def bench_audio_callback(blocks=20000, blocksize=2048, amplification=2.5,
+                         repeat=5):
+    """Стоимость обработки одного блока в audio_callback.
+
+    Блок int16 с шумом ±8000 (усиление не упирается в ограничение);
+    время — лучший из repeat прогонов по blocks блоков.
+    """
+    from audio_capture import AudioRingBuffer, BlockAmplifier
+
+    rng = np.random.default_rng(0)
+    indata = rng.integers(
+        -8000, 8000, size=(blocksize, 1), dtype=np.int16
+    )
+
+    audio_queue = queue.Queue()
+
+    def legacy_block(i):
+        audio_queue.put(legacy_amplify_block(indata, amplification))
+        if i % 100 == 0:
+            audio_queue.queue.clear()
+
+    amplifier = BlockAmplifier(blocksize)
+    ring = AudioRingBuffer(16000 * 30)
+
+    def current_block(i):
+        ring.write(amplifier.process(indata[:, 0], amplification))
+
+    legacy = best_per_call(legacy_block, blocks, repeat)
+    current = best_per_call(current_block, blocks, repeat)
+
+    print(
+        f"audio_callback, блок {blocksize}, лучший из {repeat}: "
+        f"прежний (float + queue) {legacy * 1e6:.1f} мкс, "
+        f"текущий (int Q8 + кольцевой буфер) {current * 1e6:.1f} мкс"
+    )
+
+
+def bench_vad(blocks=5000, blocksize=4096, sample_rate=16000):
+    """Детектор речи на блок против прежнего RMS в recognize.
+
+    Блоки: громкая речь, тишина и шум между порогами гистерезиса
+    (только там считаются пересечения нуля — худший случай).
+    """
+    from vad import VoiceActivityDetector
+
+    rng = np.random.default_rng(0)
+    signals = {
+        "речь": rng.integers(-8000, 8000, size=blocksize, dtype=np.int16),
+        "тишина": rng.normal(0, 65, blocksize).astype(np.int16),
+        "между порогами": rng.normal(0, 262, blocksize).astype(np.int16),
+    }
+    for name, block in signals.items():
+        start = time.perf_counter()
+        for _ in range(blocks):
+            # Прежний расчёт: квадраты int16 переполняются
+            with np.errstate(invalid="ignore"):
+                np.sqrt(np.mean(block**2)) / 32768.0
+        legacy = (time.perf_counter() - start) / blocks
+
+        detector = VoiceActivityDetector(sample_rate)
+        start = time.perf_counter()
+        for _ in range(blocks):
+            detector.process(block)
+        current = (time.perf_counter() - start) / blocks
+
+        print(
+            f"VAD, блок {blocksize} ({name}): прежний RMS (с переполнением) "
+            f"{legacy * 1e6:.1f} мкс, кадровый VAD {current * 1e6:.1f} мкс"
+        )
+
+
+def translation_corpus(size=200):
+    """Фиксированный корпус уникальных предложений разной длины."""
+    templates = [
+        "Заказ номер {i} будет доставлен завтра.",
+        "Пожалуйста, проверьте документы клиента {i} перед началом смены.",
+        "Оператор {i} подтвердил получение сообщения.",
+        "Спасибо за звонок, мы перезвоним вам в течение {i} минут, "
+        "как только специалист освободится.",
+    ]
+    return [
+        templates[i % len(templates)].format(i=i) for i in range(size)
+    ]
+
+
+def bench_translate_batch(source_lang="ru", target_lang="en", size=200):
+    """Предложений в секунду: translate_text по одному против translate_batch.
+
+    Требует установленных пакетов Argos; кэш переводов отключён.
+    """
+    from translation import BATCH_STATS, Translator
+    from utils import get_models_paths
+
+    corpus = translation_corpus(size)
+    translator = Translator(get_models_paths(), cache_size=0, headless=True)
+    # Прогрев: первая загрузка модели не должна попадать в замер
+    translator.translate_text(corpus[0], source_lang, target_lang)
+
+    start = time.perf_counter()
+    for sentence in corpus:
+        translator.translate_text(sentence, source_lang, target_lang)
+    single = len(corpus) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    translator.translate_batch(corpus, source_lang, target_lang)
+    batched = len(corpus) / (time.perf_counter() - start)
+
+    print(
+        f"Перевод {source_lang}->{target_lang}, {len(corpus)} предложений: "
+        f"по одному {single:.1f} предл./с, пакетно {batched:.1f} предл./с"
+    )
+    # Без этой проверки «пакетный» замер мог молча мерить перевод
+    # по одному предложению
+    print(
+        f"Пакетом: {BATCH_STATS['batched']}, "
+        f"по одному: {BATCH_STATS['fallback']} предложений"
+    )
+    if BATCH_STATS["fallback"] or not BATCH_STATS["batched"]:
+        raise SystemExit("Пакетный путь перевода не сработал")
+
+
+def calibration_recording(sample_rate=16000, seconds=3.0):
+    """Синтетическая запись: шум и три «фразы» с паузами."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    samples = rng.normal(0, 0.002, t.size).astype(np.float32)
+    for start in (0.3, 1.2, 2.1):
+        mask = (t >= start) & (t < start + 0.6)
+        samples[mask] += 0.08 * np.sin(2 * np.pi * 220 * t[mask])
+    return samples
+
+
+def bench_calibration(runs=200, sample_rate=16000):
+    """Анализ калибровочной записи (без микрофона)."""
+    from calibration import analyze_calibration_recording
+
+    samples = calibration_recording(sample_rate)
+    start = time.perf_counter()
+    for _ in range(runs):
+        analysis = analyze_calibration_recording(samples, sample_rate)
+    elapsed = (time.perf_counter() - start) / runs
+
+    print(
+        f"Калибровка, {len(samples) / sample_rate:.0f} с записи: "
+        f"анализ {elapsed * 1000:.2f} мс, "
+        f"усиление {analysis['amplification']:.2f}, "
+        f"порог {analysis['silence_threshold']:.4f}"
+    )
+
+
+BENCHMARKS = {
+    "audio": bench_audio_callback,
+    "vad": bench_vad,
+    "translate": bench_translate_batch,
+    "calibration": bench_calibration,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "names", nargs="*", help=f"из: {', '.join(BENCHMARKS)}"
+    )
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"неизвестные бенчмарки: {', '.join(sorted(unknown))}")
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
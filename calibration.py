@@ -0,0 +1,86 @@
+"""Анализ калибровочной записи.
+
+Модуль не зависит от sounddevice, поэтому калибровку можно проверять
+на WAV-файлах без PortAudio (например, benchmarks.py calibration).
+"""
+import wave
+
+import numpy as np
+
+from utils import downmix
+
+# Параметры анализа калибровочной записи
+CALIBRATION_FRAME_SECONDS = 0.05
+# Желаемый RMS речи после усиления и допустимый пик (без клиппинга)
+TARGET_SPEECH_RMS = 0.25
+MAX_PEAK_LEVEL = 0.9
+MIN_AMPLIFICATION = 1.0
+MAX_AMPLIFICATION = 4.0
+DEFAULT_AMPLIFICATION = 2.0
+
+
+def analyze_calibration_recording(samples, sample_rate):
+    """Вычисляет усиление и порог тишины по одной записи.
+
+    samples — отсчёты float в диапазоне [-1, 1]. Запись делится на кадры
+    по 50 мс; уровень шума — 10-й перцентиль RMS кадров, речь — кадры
+    громче шума. Усиление выбирается так, чтобы RMS речи приблизился
+    к TARGET_SPEECH_RMS, а пик речи не превысил MAX_PEAK_LEVEL.
+    """
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+    frame = max(1, int(CALIBRATION_FRAME_SECONDS * sample_rate))
+    frames_count = len(samples) // frame
+    if frames_count == 0:
+        raise ValueError("Калибровочная запись слишком короткая")
+
+    frames = samples[:frames_count * frame].reshape(frames_count, frame)
+    frame_rms = np.sqrt(np.mean(frames * frames, axis=1))
+    frame_peak = np.max(np.abs(frames), axis=1)
+
+    noise_rms = float(np.percentile(frame_rms, 10))
+    silence_threshold = max(0.01, noise_rms * 5)
+
+    speech = frame_rms > silence_threshold
+    if np.any(speech):
+        speech_rms = float(np.sqrt(np.mean(frame_rms[speech] ** 2)))
+        speech_peak = float(np.max(frame_peak[speech]))
+        gain = TARGET_SPEECH_RMS / max(speech_rms, 1e-6)
+        if speech_peak > 0:
+            gain = min(gain, MAX_PEAK_LEVEL / speech_peak)
+        amplification = float(
+            np.clip(gain, MIN_AMPLIFICATION, MAX_AMPLIFICATION)
+        )
+    else:
+        speech_rms = 0.0
+        speech_peak = 0.0
+        amplification = DEFAULT_AMPLIFICATION
+
+    return {
+        "amplification": amplification,
+        "silence_threshold": silence_threshold,
+        "noise_rms": noise_rms,
+        "speech_rms": speech_rms,
+        "speech_peak": speech_peak,
+        "speech_ratio": float(np.mean(speech)),
+    }
+
+
+def read_wav_samples(path):
+    """Читает WAV (16 бит) и возвращает (отсчёты float32 моно, частота).
+
+    Каналы сводятся в моно так же, как при распознавании файлов.
+    """
+    with wave.open(str(path), "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{path}: нужен 16-битный WAV")
+        channels = wav.getnchannels()
+        sample_rate = wav.getframerate()
+        data = np.frombuffer(wav.readframes(wav.getnframes()), np.int16)
+    data = downmix(data, channels)
+    return data.astype(np.float32) / 32768.0, sample_rate
+
+
+def analyze_wav(path):
+    """Анализ калибровки по готовой записи (без микрофона)."""
+    samples, sample_rate = read_wav_samples(path)
+    return analyze_calibration_recording(samples, sample_rate)
@@ -0,0 +1,139 @@
+import itertools
+import queue
+import threading
+import time
+
+from logger_setup import logger
+
+
+class SpeechPipeline:
+    """Конвейер распознавание -> перевод -> озвучка.
+
+    Распознавание идёт в потоке записи и отдаёт готовые фразы в submit();
+    перевод и озвучка работают в своих потоках. Стадии связаны
+    ограниченными очередями: если перевод или озвучка отстают, submit()
+    блокируется, и новая запись не начнётся, пока не освободится место.
+    Так распознавание фразы N+1 идёт одновременно с переводом
+    и озвучкой фразы N.
+
+    echo_suppression=True: пока идёт запись, озвучка не начинается,
+    а начало записи прерывает текущую озвучку, чтобы синтезированная
+    речь не попала в микрофон. С наушниками опцию можно выключить.
+    """
+
+    def __init__(self, translator, speak_callback=None,
+                 translated_callback=None, queue_size=2,
+                 echo_suppression=True):
+        self.translator = translator
+        self.speak_callback = speak_callback or translator.speak
+        self.translated_callback = translated_callback
+        self.echo_suppression = echo_suppression
+        self.translation_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.speech_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.capture_idle = threading.Event()
+        self.capture_idle.set()
+        self.ids = itertools.count(1)
+        self.threads = [
+            threading.Thread(
+                target=self._translation_loop, name="pipeline-translate",
+                daemon=True
+            ),
+            threading.Thread(
+                target=self._speech_loop, name="pipeline-speak",
+                daemon=True
+            ),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def begin_capture(self):
+        """Вызывается при начале записи."""
+        if self.echo_suppression:
+            self.capture_idle.clear()
+            self.translator.stop_speaking()
+
+    def end_capture(self):
+        """Вызывается по окончании записи."""
+        self.capture_idle.set()
+
+    def submit(self, text, source_lang, target_lang, streaming=None):
+        """Передаёт распознанную фразу на перевод и озвучку.
+
+        streaming — StreamingTranslation этой фразы, если перевод шёл
+        по ходу распознавания. Блокируется, если очередь перевода полна.
+        """
+        utterance_id = next(self.ids)
+        started = time.perf_counter()
+        self.translation_queue.put(
+            (utterance_id, text, source_lang, target_lang, streaming)
+        )
+        waited = time.perf_counter() - started
+        if waited > 0.05:
+            logger.info(
+                f"Фраза {utterance_id}: ожидание очереди перевода "
+                f"{waited:.2f} с"
+            )
+        return utterance_id
+
+    def _translate(self, text, source_lang, target_lang, streaming):
+        translated = streaming.finish() if streaming else ""
+        if not translated:
+            translated = self.translator.translate_text(
+                text, source_lang, target_lang
+            )
+        return translated
+
+    def _translation_loop(self):
+        while True:
+            item = self.translation_queue.get()
+            if item is None:
+                self.speech_queue.put(None)
+                break
+            utterance_id, text, source_lang, target_lang, streaming = item
+            try:
+                translated = self._translate(
+                    text, source_lang, target_lang, streaming
+                )
+            except Exception as e:
+                logger.error(f"Ошибка перевода фразы {utterance_id}: {e}")
+                continue
+            self.translator.last_translation = translated
+            if self.translated_callback:
+                self.translated_callback(translated)
+            if translated.strip():
+                self.speech_queue.put((utterance_id, translated, target_lang))
+
+    def _speech_loop(self):
+        while True:
+            item = self.speech_queue.get()
+            if item is None:
+                break
+            utterance_id, translated, target_lang = item
+            # С подавлением эха не говорим поверх записи
+            self.capture_idle.wait()
+            done = threading.Event()
+            try:
+                self.speak_callback(
+                    translated, target_lang, finish_callback=done.set
+                )
+            except Exception as e:
+                logger.error(f"Ошибка озвучки фразы {utterance_id}: {e}")
+                continue
+            done.wait()
+
+    @staticmethod
+    def _drain(pending):
+        try:
+            while True:
+                pending.get_nowait()
+        except queue.Empty:
+            pass
+
+    def close(self, timeout=2.0):
+        """Отбрасывает ожидающие фразы и останавливает стадии."""
+        self._drain(self.translation_queue)
+        self._drain(self.speech_queue)
+        self.capture_idle.set()
+        self.translation_queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout=timeout)
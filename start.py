@@ -1,3 +1,4 @@
+import importlib
 import json
 import keyboard
 import os
@@ -5,28 +6,24 @@ import sys
 import tkinter as tk
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import ttk, colorchooser
 
-from audio_utils import (
-    get_calibrated_amplification,
-    get_calibrated_silence_threshold
-)
 from logger_setup import logger
-from translation import Translator, set_amplification_factor
-
-
-def resource_path(relative_path):
-    """Получить абсолютный путь к ресурсу, работает в dev и с PyInstaller"""
-    try:
-        base_path = sys._MEIPASS  # type: ignore
-    except AttributeError:
-        base_path = os.path.abspath(".")
-
-    return os.path.join(base_path, relative_path)
-
-
-def get_model_path(rel_path):
-    return resource_path(rel_path)
+from utils import get_models_paths, resource_path
+
+# Тяжёлые модули (argostranslate тянет torch, stanza и ctranslate2)
+# импортируются в фоне после появления окна, с замером времени
+HEAVY_MODULES = [
+    "numpy",
+    "sounddevice",
+    "vosk",
+    "argostranslate.translate",
+    "audio_utils",
+    "translation",
+]
+startup_begin = time.perf_counter()
+startup_timings = {}
 
 
 # Конфигурационный файл для сохранения настроек
@@ -40,7 +37,35 @@ def load_config():
         "window_alpha": 0.9,
         "input_lang": "ru",
         "output_lang": "en",
-        "amplification": 2.0
+        "amplification": 2.0,
+        # Перевод сегментов речи по мере распознавания
+        "streaming_translation": True,
+        # Предварительный перевод устойчивых частичных результатов
+        "stream_partials": False,
+        # Размер LRU-кэша переводов (0 — отключить) и файл для него
+        "translation_cache_size": 2048,
+        "translation_cache_file": "translation_cache.json",
+        # Не озвучивать во время записи и прерывать озвучку началом
+        # записи (выключите, если используете наушники)
+        "echo_suppression": True,
+        # Переводить текст в поле ввода по мере набора (без озвучки)
+        "live_translation": False,
+        "live_translation_delay_ms": 400,
+        # Декодировать только речь; конец фразы — по детектору речи
+        "vad_gating": False,
+        # Сколько фраз может ждать перевода и озвучки
+        "pipeline_queue_size": 2,
+        # Сколько моделей Vosk одновременно держать в памяти
+        "max_resident_models": 2,
+        # Заново искать и калибровать микрофон при каждом запуске
+        "recalibrate_microphone": False,
+        # Голоса озвучки по языкам: id или часть имени, можно списком
+        # в порядке предпочтения, например {"zh": ["Huihui", "Yaoyao"]}
+        "tts_voices": {},
+        # Кэш синтезированной речи: каталог и лимиты памяти и диска (МБ)
+        "tts_cache_dir": "tts_cache",
+        "tts_cache_memory_mb": 32,
+        "tts_cache_disk_mb": 200
     }
 
     try:
@@ -56,13 +81,9 @@ def load_config():
 # Загружаем конфигурацию
 config = load_config()
 
-models_paths = {
-    "en": get_model_path("model_en/vosk-model-small-en-us-0.15"),
-    "fr": get_model_path("model_fr/vosk-model-small-fr-0.22"),
-    "ru": get_model_path("model_ru/vosk-model-small-ru-0.22"),
-    "zh": get_model_path("model_zh/vosk-model-small-cn-0.22"),
-}
+models_paths = get_models_paths()
 recording_thread = None
+recording_press_time = None
 
 
 root = tk.Tk()
@@ -236,16 +257,44 @@ status_canvas = tk.Canvas(root, width=20, height=20, bg=config["bg_color"])
 status_canvas.pack(pady=10)
 status_oval = status_canvas.create_oval(2, 2, 18, 18, fill="green")
 
-translator = Translator(models_paths)
+boot_status = tk.StringVar(value="Загрузка...")
+tk.Label(
+    root,
+    textvariable=boot_status,
+    bg=config["bg_color"],
+    font=("Arial", 9)
+).pack()
+
+# Заполняются фоновой загрузкой (boot)
+translator = None
+translation_module = None
+pipeline = None
+# Модель выбранного языка распознавания загружена, запись разрешена
+language_ready = threading.Event()
 
 tts_busy = threading.Event()
 recording_active = threading.Event()
 recording_lock = threading.Lock()
-last_spoken_text = ""
+# Последняя озвучка: текст перевода или (текст, языки) запроса по кнопке
+last_spoken_key = None
 last_spoken_time = 0
 
 manual_stop_requested = threading.Event()
 
+# Перевод введённого текста идёт вне потока Tk; побеждает новый запрос
+manual_executor = ThreadPoolExecutor(max_workers=1)
+manual_request_id = 0
+# Последний запрос с озвучкой: только он снимает флаг tts_busy
+spoken_request_id = 0
+# Перевод при вводе: отложенный запуск и память предложений по парам языков.
+# Свой номер запроса, чтобы ввод не отменял перевод с озвучкой;
+# live_translation_text — последний переведённый или вставленный
+# программно текст поля, повторно он не переводится
+live_translation_after_id = None
+live_request_id = 0
+live_translation_text = ""
+live_translations = {}
+
 # Фрейм для настроек микрофона
 settings_frame = tk.Frame(root, bg=config["bg_color"])
 settings_frame.pack(pady=5, fill="x", padx=10)
@@ -256,6 +305,12 @@ tk.Label(
     bg=config["bg_color"]
 ).pack(side=tk.LEFT)
 
+
+def on_sensitivity_change(value):
+    if translator is not None:
+        translator.set_amplification(value)
+
+
 sensitivity_scale = tk.Scale(
     settings_frame,
     from_=1.0,
@@ -267,26 +322,152 @@ sensitivity_scale = tk.Scale(
     fg="black",
     troughcolor=config["bg_color"],
     length=200,
-    command=set_amplification_factor,
+    command=on_sensitivity_change,
 )
 
 
 def translate_text_from_input_field():
+    global manual_request_id, spoken_request_id, live_request_id
+    global live_translation_text
+
+    if translator is None:
+        logger.info("Переводчик ещё загружается")
+        return
     text = input_text_widget.get("1.0", "end-1c").strip()
     if not text:
         logger.info("Поле ввода пустое")
         return
+    source_lang, target_lang = input_lang_var.get(), output_lang_var.get()
+    if is_recent_duplicate((text, source_lang, target_lang)):
+        # Повтор не прерывает и не повторяет озвучку, но перевод
+        # показывается снова (поле вывода могли перезаписать)
+        logger.debug("Пропускаем озвучку - тот же текст был недавно")
+        submit_live_translation(text, source_lang, target_lang)
+        return
+
+    manual_request_id += 1
+    spoken_request_id = manual_request_id
+    # Перевод по кнопке заменяет незавершённый перевод при вводе
+    live_request_id += 1
+    live_translation_text = text
+    if tts_busy.is_set():
+        # Новый запрос важнее: прежняя озвучка прерывается
+        translator.stop_speaking()
+    tts_busy.set()
+    manual_executor.submit(
+        translate_manual_text, manual_request_id, text,
+        source_lang, target_lang
+    )
+
+
+def translate_manual_text(request_id, text, source_lang, target_lang):
+    """Перевод введённого текста в рабочем потоке.
+
+    Результат попадает в output_text только у самого нового запроса;
+    устаревший запрос прекращает перевод на следующем предложении.
+    """
+    def is_current():
+        return request_id == manual_request_id
+
+    def publish(translated):
+        root.after(0, lambda: is_current() and output_text.set(translated))
+
+    def finish():
+        if request_id == spoken_request_id:
+            on_tts_finish()
+
+    if not is_current():
+        finish()
+        return
     try:
-        translated = translator.translate_text(
-            text, input_lang_var.get(), output_lang_var.get()
+        # Каждое предложение озвучивается, как только переведено
+        translator.translate_and_speak(
+            text, source_lang, target_lang,
+            sentence_callback=publish,
+            finish_callback=finish,
+            cancelled=lambda: not is_current(),
         )
-        output_text.set(translated)
-        translator.last_translation = translated
-        speak_and_notify(translated, output_lang_var.get())
     except Exception as exc:
+        finish()
         logger.error(f"Ошибка перевода текста: {exc}", exc_info=True)
 
 
+def schedule_live_translation(event=None):
+    """Перезапускает таймер перевода при вводе (debounce)."""
+    global live_translation_after_id
+
+    if not live_translation_var.get():
+        return
+    if live_translation_after_id is not None:
+        root.after_cancel(live_translation_after_id)
+    live_translation_after_id = root.after(
+        config.get("live_translation_delay_ms", 400), start_live_translation
+    )
+
+
+def on_input_modified(event=None):
+    """Текст поля изменился: ввод, вставка мышью, удаление."""
+    # Флаг изменения сбрасывается, иначе <<Modified>> больше не придёт
+    input_text_widget.edit_modified(False)
+    schedule_live_translation()
+
+
+def set_input_text(text):
+    """Программная замена текста поля без перевода при вводе."""
+    global live_translation_text
+
+    live_translation_text = text.strip()
+    input_text_widget.delete("1.0", "end")
+    input_text_widget.insert("1.0", text)
+
+
+def start_live_translation():
+    global live_translation_after_id
+
+    live_translation_after_id = None
+    if translator is None:
+        return
+    text = input_text_widget.get("1.0", "end-1c").strip()
+    if not text or text == live_translation_text:
+        return
+    submit_live_translation(text, input_lang_var.get(), output_lang_var.get())
+
+
+def submit_live_translation(text, source_lang, target_lang):
+    """Перевод без озвучки; прежний перевод при вводе отменяется."""
+    global live_request_id, live_translation_text
+
+    live_translation_text = text
+    live_request_id += 1
+    manual_executor.submit(
+        translate_live_text, live_request_id, text, source_lang, target_lang
+    )
+
+
+def translate_live_text(request_id, text, source_lang, target_lang):
+    """Перевод при вводе в рабочем потоке, без озвучки."""
+    def is_current():
+        return request_id == live_request_id
+
+    if not is_current():
+        return
+    key = (source_lang, target_lang)
+    if key not in live_translations:
+        live_translations[key] = translation_module.IncrementalTranslation(
+            translator, source_lang, target_lang
+        )
+    try:
+        translated = live_translations[key].translate(
+            text, cancelled=lambda: not is_current()
+        )
+    except Exception as exc:
+        logger.error(f"Ошибка перевода при вводе: {exc}", exc_info=True)
+        return
+    if translated is not None and is_current():
+        translator.last_translation = translated
+        root.after(0, lambda: is_current() and output_text.set(translated))
+
+
 def set_status_color(color):
     status_canvas.itemconfig(status_oval, fill=color)
 
@@ -296,23 +477,40 @@ def on_tts_finish():
     root.after(0, lambda: set_status_color("green"))
 
 
-def speak_and_notify(text, lang):
-    global last_spoken_text, last_spoken_time
+def is_recent_duplicate(key):
+    """То же самое уже озвучивалось в последние 5 секунд."""
+    global last_spoken_key, last_spoken_time
 
     current_time = time.time()
-    if text == last_spoken_text and (current_time - last_spoken_time) < 5:
+    if key == last_spoken_key and (current_time - last_spoken_time) < 5:
+        return True
+    last_spoken_key = key
+    last_spoken_time = current_time
+    return False
+
+
+def speak_and_notify(text, lang, finish_callback=None):
+    if is_recent_duplicate(text):
         logger.debug("Пропускаем озвучку - тот же текст был недавно")
+        if finish_callback:
+            finish_callback()
         return
 
-    last_spoken_text = text
-    last_spoken_time = current_time
+    def on_finish():
+        on_tts_finish()
+        if finish_callback:
+            finish_callback()
 
     tts_busy.set()
-    translator.speak(text, lang, finish_callback=on_tts_finish)
+    translator.speak(text, lang, finish_callback=on_finish)
+
+
+def on_pipeline_translation(translated):
+    root.after(0, lambda: output_text.set(translated))
 
 
 def play_last_translation():
-    if translator.last_translation:
+    if translator and translator.last_translation:
         speak_and_notify(translator.last_translation, output_lang_var.get())
     else:
         logger.info("Нет перевода для воспроизведения")
@@ -328,10 +526,14 @@ def safe_release_lock(lock):
 
 
 def start_recording():
-    global recording_thread
+    global recording_thread, recording_press_time
 
-    if tts_busy.is_set() or recording_active.is_set():
-        logger.info("Занято или запись уже идет, старт пропущен")
+    if not language_ready.is_set():
+        logger.info("Модель распознавания ещё загружается, старт пропущен")
+        return
+
+    if recording_active.is_set():
+        logger.info("Запись уже идет, старт пропущен")
         return
 
     if recording_thread and recording_thread.is_alive():
@@ -344,9 +546,12 @@ def start_recording():
         return
 
     logger.info("Старт записи")
+    recording_press_time = time.time()
+    started = False
     try:
         recording_active.set()
         manual_stop_requested.clear()
+        pipeline.begin_capture()
         root.after(0, progress_bar.start)
         root.after(0, lambda: set_status_color("red"))
         root.after(0, lambda: input_text.set("Говорите..."))
@@ -356,11 +561,17 @@ def start_recording():
             daemon=True
         )
         recording_thread.start()
+        started = True
 
     except Exception as e:
         logger.error(f"Ошибка при старте записи: {e}")
         recording_active.clear()
         safe_release_lock(recording_lock)
+    finally:
+        # Запущенный поток записи сам вызовет end_capture; без него
+        # озвучка ждала бы capture_idle вечно
+        if not started:
+            pipeline.end_capture()
 
 
 def stop_recording():
@@ -372,39 +583,54 @@ def stop_recording():
 
     logger.info("Запрос ручной остановки записи")
     manual_stop_requested.set()
+    translator.wake()
 
 
 def record_and_process():
     global recording_thread
 
     try:
-        translator.set_language(input_lang_var.get())
+        source_lang = input_lang_var.get()
+        target_lang = output_lang_var.get()
+        translator.set_language(source_lang)
+
+        streaming = None
+        if config.get("streaming_translation", True):
+            streaming = translation_module.StreamingTranslation(
+                translator, source_lang, target_lang,
+                update_callback=lambda t: root.after(
+                    0, lambda: output_text.set(t)
+                ),
+            )
 
         text = translator.recognize(
-            manual_stop_callback=lambda: manual_stop_requested.is_set()
+            stop_event=manual_stop_requested,
+            press_time=recording_press_time,
+            segment_callback=streaming.on_segment if streaming else None,
+            partial_callback=(
+                streaming.on_partial
+                if streaming and config.get("stream_partials", False)
+                else None
+            ),
         )
 
-        def update_input_text_widget(t):
-            input_text_widget.delete("1.0", "end")
-            input_text_widget.insert("1.0", t)
-
-        root.after(0, lambda: update_input_text_widget(text))
+        root.after(0, lambda: set_input_text(text))
+        pipeline.end_capture()
 
         if text.strip():
-            translated = translator.translate_text(
-                text, input_lang_var.get(), output_lang_var.get()
-            )
-            root.after(0, lambda: output_text.set(translated))
-            speak_and_notify(translated, output_lang_var.get())
+            # Перевод и озвучка идут в своих потоках; запись освобождается
+            pipeline.submit(text, source_lang, target_lang, streaming)
         else:
+            if streaming:
+                streaming.cancel()
             logger.info("Пустой результат распознавания, пропускаем перевод")
 
     except Exception as exc:
         logger.error(f"Error in record_and_process: {exc}", exc_info=True)
         err_msg = "Ошибка распознавания"
-        root.after(0, lambda: input_text_widget.delete("1.0", "end"))
-        root.after(0, lambda: input_text_widget.insert("1.0", err_msg))
+        root.after(0, lambda: set_input_text(err_msg))
     finally:
+        pipeline.end_capture()
         root.after(0, progress_bar.stop)
         root.after(0, lambda: set_status_color("green"))
         recording_active.clear()
@@ -415,9 +641,38 @@ def record_and_process():
 
 def on_language_change(*args):
     """Сохраняет настройки языков при изменении."""
+    input_changed = config["input_lang"] != input_lang_var.get()
     config["input_lang"] = input_lang_var.get()
     config["output_lang"] = output_lang_var.get()
     # save_config(config)
+    if translator is not None and input_changed:
+        prepare_input_language(config["input_lang"])
+
+
+def set_recording_enabled(enabled):
+    btn_hold.configure(state=tk.NORMAL if enabled else tk.DISABLED)
+
+
+def prepare_input_language(lang_code):
+    """Загружает модель языка в фоне; запись недоступна до готовности."""
+    language_ready.clear()
+    root.after(0, lambda: set_recording_enabled(False))
+    root.after(0, lambda: boot_status.set(f"Загрузка модели {lang_code}..."))
+
+    def on_loaded(loaded):
+        # Пока грузили, пользователь мог выбрать другой язык
+        if lang_code != input_lang_var.get():
+            return
+        if loaded:
+            language_ready.set()
+            root.after(0, lambda: set_recording_enabled(True))
+            root.after(0, lambda: boot_status.set("Готово"))
+        else:
+            root.after(0, lambda: boot_status.set(
+                f"Модель {lang_code} не загружена"
+            ))
+
+    translator.preload_language(lang_code, callback=on_loaded)
 
 
 # Привязываем обработчики изменений
@@ -431,6 +686,7 @@ btn_hold = tk.Button(
     font=("Arial", 12),
 )
 btn_hold.pack(pady=15)
+set_recording_enabled(False)
 btn_hold.bind("<ButtonPress>", lambda e: start_recording())
 btn_hold.bind("<ButtonRelease>", lambda e: stop_recording())
 
@@ -476,6 +732,21 @@ tk.Label(
 
 input_text_widget = tk.Text(root, height=5, width=50, font=("Arial", 10))
 input_text_widget.pack(padx=10, pady=(0, 10))
+# Любое изменение текста (клавиатура, вставка мышью); распознанный текст
+# вставляется через set_input_text и повторно не переводится
+input_text_widget.bind("<<Modified>>", on_input_modified)
+
+live_translation_var = tk.BooleanVar(
+    value=config.get("live_translation", False)
+)
+tk.Checkbutton(
+    root,
+    text="Переводить при вводе",
+    variable=live_translation_var,
+    command=schedule_live_translation,
+    bg=config["bg_color"],
+    font=("Arial", 9)
+).pack()
 
 translation_frame = tk.Frame(root, bg=config["bg_color"])
 translation_frame.pack(fill="x", pady=(10, 0), padx=10)
@@ -517,26 +788,126 @@ translate_btn = tk.Button(
 )
 translate_btn.pack(pady=(0, 15))
 
-# Информация о калибровке
+# Информация о калибровке (заполняется после выбора микрофона)
 calibration_info = tk.Label(
     root,
-    text=(
-        f"Калибровка: усиление {get_calibrated_amplification():.1f}x, "
-        f"порог {get_calibrated_silence_threshold():.4f}"
-    ),
+    text="Калибровка: выполняется...",
     bg=config["bg_color"],
     font=("Arial", 8)
 )
 calibration_info.pack(pady=5)
 
 
+def set_boot_status(text):
+    root.after(0, lambda: boot_status.set(text))
+
+
+def boot():
+    """Фоновая загрузка: модули, микрофон, модель выбранного языка."""
+    global translator, translation_module, pipeline
+
+    try:
+        for number, name in enumerate(HEAVY_MODULES, 1):
+            set_boot_status(
+                f"Загрузка модулей ({number}/{len(HEAVY_MODULES)}): {name}"
+            )
+            start = time.perf_counter()
+            importlib.import_module(name)
+            startup_timings[f"import {name}"] = time.perf_counter() - start
+        translation_module = importlib.import_module("translation")
+        audio_utils = importlib.import_module("audio_utils")
+
+        # Движок озвучки и индекс голосов готовятся параллельно с загрузкой
+        speech_worker = importlib.import_module("tts").get_speech_worker()
+        speech_worker.configure(
+            languages=languages,
+            voice_overrides=config.get("tts_voices", {}),
+            cache_dir=config.get("tts_cache_dir", "tts_cache"),
+            cache_memory_mb=config.get("tts_cache_memory_mb", 32),
+            cache_disk_mb=config.get("tts_cache_disk_mb", 200),
+        )
+        speech_worker.start()
+
+        set_boot_status("Выбор и калибровка микрофона...")
+        start = time.perf_counter()
+        new_translator = translation_module.Translator(
+            models_paths,
+            cache_size=config.get("translation_cache_size", 2048),
+            cache_path=config.get(
+                "translation_cache_file", "translation_cache.json"
+            ),
+            max_resident_models=config.get("max_resident_models", 2),
+            recalibrate=(
+                "--recalibrate" in sys.argv
+                or config.get("recalibrate_microphone", False)
+            ),
+            gate_decoder=config.get("vad_gating", False),
+        )
+        startup_timings["Translator"] = time.perf_counter() - start
+
+        calibration_text = (
+            f"Калибровка: усиление "
+            f"{audio_utils.get_calibrated_amplification():.1f}x, "
+            f"порог {audio_utils.get_calibrated_silence_threshold():.4f}"
+        )
+        root.after(0, lambda: calibration_info.configure(
+            text=calibration_text
+        ))
+
+        lang_code = input_lang_var.get()
+        set_boot_status(f"Загрузка модели {lang_code}...")
+        start = time.perf_counter()
+        new_translator.set_language(lang_code)
+        startup_timings[f"модель {lang_code}"] = time.perf_counter() - start
+
+        pipeline = importlib.import_module("pipeline").SpeechPipeline(
+            new_translator,
+            speak_callback=speak_and_notify,
+            translated_callback=on_pipeline_translation,
+            queue_size=config.get("pipeline_queue_size", 2),
+            echo_suppression=config.get("echo_suppression", True),
+        )
+        translator = new_translator
+        if lang_code == input_lang_var.get():
+            language_ready.set()
+            root.after(0, lambda: set_recording_enabled(True))
+            set_boot_status("Готово")
+        else:
+            prepare_input_language(input_lang_var.get())
+    except Exception as e:
+        logger.error(f"Ошибка загрузки: {e}", exc_info=True)
+        set_boot_status("Ошибка загрузки, см. журнал")
+        return
+    finally:
+        startup_timings["до готовности"] = (
+            time.perf_counter() - startup_begin
+        )
+        logger.info("Замеры запуска: " + ", ".join(
+            f"{name}={seconds:.2f}с"
+            for name, seconds in startup_timings.items()
+        ))
+
+
 def on_closing():
     """Обработчик закрытия окна."""
+    global manual_request_id, live_request_id
+
     config["amplification"] = sensitivity_var.get()
     # save_config(config)
+    # Незавершённый перевод введённого текста больше не нужен
+    manual_request_id += 1
+    live_request_id += 1
+    manual_executor.shutdown(wait=False)
+    if pipeline is not None:
+        pipeline.close()
+    if translator is not None:
+        translator.stop()
     root.destroy()
 
 
 root.protocol("WM_DELETE_WINDOW", on_closing)
 
+startup_timings["окно"] = time.perf_counter() - startup_begin
+threading.Thread(target=boot, daemon=True).start()
+
 root.mainloop()
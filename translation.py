@@ -2,156 +2,466 @@ import argostranslate.translate
 import json
 import numpy as np
 import os
-import pyttsx3
-import queue
-import sounddevice as sd
+import re
 import time
 import threading
+import wave
 
-from audio_utils import (
-    auto_select_microphone,
-    get_calibrated_amplification,
-    get_calibrated_silence_threshold
-)
-from collections.abc import Iterable
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from logger_setup import logger
-from utils import AudioProcessor
+from translation_cache import TranslationCache
+from tts import get_speech_worker
+from utils import AudioProcessor, downmix
+from vad import VoiceActivityDetector
 from vosk import Model, KaldiRecognizer
 
 os.environ["SD_DISABLE_ASIO"] = "1"
 
-audio_queue = queue.Queue()
-# Используем калиброванное значение
-current_amplification = get_calibrated_amplification()
+# Символы, по которым перевод на китайский считается испорченным
+BROKEN_CHARS = ("\ufffd", "\ue4cf")
+# Тишина после речи, по которой детектор завершает сегмент Vosk
+VAD_SEGMENT_ENDPOINT_SECONDS = 0.5
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+|(?<=[。！？])")
+# Сокращения, после которых предложение не заканчивается. Только те,
+# что не ставят в конце предложения («и т.д.», «etc.», «5 см.» — ставят)
+ABBREVIATIONS = frozenset({
+    "mr", "mrs", "ms", "dr", "prof", "st", "jr", "sr", "vs", "e.g", "i.e",
+    "mt", "mme", "mlle", "cf", "т.е", "т.к", "ул", "проф", "акад",
+})
+# Языки, в которых предложения пишутся без пробела между ними
+NO_SPACE_LANGUAGES = ("zh", "ja")
+# Сколько предложений ушло пакетом и сколько — по одному
+BATCH_STATS = {"batched": 0, "fallback": 0}
+
+
+def is_valid_translation(text):
+    return len(text.strip()) > 0 and not any(c in text for c in BROKEN_CHARS)
+
+
+def ends_with_abbreviation(text):
+    """Текст кончается сокращением («Dr.», «т.е.») или инициалом («А.»)."""
+    if not text.endswith("."):
+        return False
+    words = text[:-1].split()
+    if not words:
+        return False
+    word = words[-1].lstrip("([«\"'")
+    # Инициал — одна заглавная буква; «I.» в английском — местоимение
+    if len(word) == 1 and word.isupper() and word != "I":
+        return True
+    return word.lower() in ABBREVIATIONS
+
+
+def split_sentences(text):
+    """Делит текст на предложения по концевой пунктуации.
+
+    Точка после сокращения или инициала предложение не завершает.
+    """
+    sentences = []
+    for sentence in SENTENCE_END_RE.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if sentences and ends_with_abbreviation(sentences[-1]):
+            sentences[-1] += " " + sentence
+        else:
+            sentences.append(sentence)
+    return sentences
 
 
-def audio_callback(indata, frames, time_, status):
-    if status:
-        logger.warning(f"Audio callback status: {status}")
+def join_sentences(sentences, lang_code):
+    """Собирает переведённые предложения: для китайского и японского
+    без пробелов, для остальных языков через пробел."""
+    separator = "" if lang_code in NO_SPACE_LANGUAGES else " "
+    return separator.join(sentences)
 
-    try:
-        amplification_factor = current_amplification
-        audio_float = indata.astype(np.float32) / 32768.0
 
-        # Добавляем проверку на тишину перед усилением
-        rms = np.sqrt(np.mean(audio_float**2))
-        if rms < 0.001:  # Порог очень тихого звука
-            amplified_audio = audio_float  # Не усиливаем шум
-        else:
-            amplified_audio = audio_float * amplification_factor
+def flatten_translation(translation):
+    """Раскладывает перевод Argos на переходы [((src, tgt), модель)].
 
-        amplified_audio = np.clip(amplified_audio, -1.0, 1.0)
-        amplified_data_int16 = (amplified_audio * 32767).astype(np.int16)
-        audio_queue.put(bytes(amplified_data_int16))
-    except Exception as e:
-        logger.error(f"Ошибка в audio_callback: {e}")
-        # В случае ошибки передаем оригинальные данные
-        audio_queue.put(bytes(indata))
+    Составной перевод (CompositeTranslation, атрибуты t1/t2) через
+    промежуточный язык превращается в последовательность прямых.
+    """
+    if hasattr(translation, "t1") and hasattr(translation, "t2"):
+        return (
+            flatten_translation(translation.t1)
+            + flatten_translation(translation.t2)
+        )
+    hop = (translation.from_lang.code, translation.to_lang.code)
+    return [(hop, translation)]
 
 
-def set_amplification_factor(factor):
-    global current_amplification
-    current_amplification = max(1.0, min(5.0, float(factor)))
-    logger.info(f"Установлено усиление микрофона: {current_amplification:.1f}")
+def format_chain(chain):
+    return "->".join([chain[0][0]] + [target for _, target in chain])
+
+
+def package_translation(translation):
+    """Прямой перевод пакета Argos под обёртками кэша.
+
+    get_translation в Argos 1.9 возвращает CachedTranslation, у которой
+    модель лежит в .underlying; без разворачивания пакетный путь
+    никогда не срабатывает.
+    """
+    while hasattr(translation, "underlying"):
+        translation = translation.underlying
+    return translation
+
+
+def translate_sentences_batched(translation, sentences):
+    """Переводит список предложений одним вызовом CTranslate2.
+
+    Повторяет apply_packaged_translation из Argos (токенизатор пакета,
+    target_prefix, те же параметры translate_batch), но для всего
+    списка сразу. Если объект перевода этого не позволяет (составной
+    перевод, другая версия Argos), предложения переводятся по одному,
+    о чём пишется предупреждение. Счётчики путей — в BATCH_STATS.
+    """
+    package = package_translation(translation)
+    pkg = getattr(package, "pkg", None)
+    tokenizer = getattr(pkg, "tokenizer", None)
+    try:
+        if tokenizer is None or not hasattr(package, "translator"):
+            raise TypeError(type(package).__name__)
+        # Модель общая с Argos: package.translator создаётся один раз,
+        # кем бы из нас ни был первый вызов
+        if package.translator is None:
+            import ctranslate2
+            from argostranslate import settings
+
+            # Потоки из settings, иначе --ct2-threads не действует,
+            # если первым модель загрузил пакетный путь. В старых Argos
+            # этих настроек нет — тогда умолчания CTranslate2
+            package.translator = ctranslate2.Translator(
+                str(pkg.package_path / "model"),
+                device=settings.device,
+                inter_threads=getattr(settings, "inter_threads", 1),
+                intra_threads=getattr(settings, "intra_threads", 0),
+            )
+
+        target_prefix = getattr(pkg, "target_prefix", "")
+        results = package.translator.translate_batch(
+            [tokenizer.encode(s) for s in sentences],
+            target_prefix=(
+                [[target_prefix]] * len(sentences) if target_prefix else None
+            ),
+            replace_unknowns=True,
+            max_batch_size=len(sentences),
+            beam_size=4,
+            num_hypotheses=1,
+            length_penalty=0.2,
+        )
+        translated = []
+        for result in results:
+            value = tokenizer.decode(result.hypotheses[0]).lstrip()
+            if target_prefix and value.startswith(target_prefix):
+                value = value[len(target_prefix):]
+            translated.append(value.strip())
+    except Exception as e:
+        logger.warning(
+            f"Пакетный перевод недоступен, перевод по одному "
+            f"предложению: {e}"
+        )
+        BATCH_STATS["fallback"] += len(sentences)
+        return [translation.translate(s) for s in sentences]
+    BATCH_STATS["batched"] += len(sentences)
+    return translated
 
 
 def speak_text(text, lang_code=None, finish_callback=None):
-    def worker():
-        if not text or len(text.strip()) < 2:
-            logger.warning("Озвучка пропущена: короткий текст")
-            if finish_callback:
-                finish_callback()
-            return
+    """Озвучивает текст в общем потоке озвучки (без ожидания)."""
+    get_speech_worker().speak(text, lang_code, finish_callback)
 
-        engine = None
-        try:
-            engine = pyttsx3.init()
-            engine.setProperty("rate", 150)
-            engine.setProperty("volume", 1.0)
-
-            if lang_code:
-                available_voices = engine.getProperty("voices")
-                if isinstance(available_voices, Iterable):
-                    lang_code_lower = lang_code.lower()
-                    for voice in available_voices:
-                        voice_langs = []
-                        for lang in getattr(voice, "languages", []):
-                            if isinstance(lang, bytes):
-                                try:
-                                    decoded = lang.decode("utf-8").lower()
-                                    voice_langs.append(decoded)
-                                except Exception:
-                                    pass
-                            else:
-                                voice_langs.append(str(lang).lower())
-
-                        if any(lang_code_lower in lang_item
-                               for lang_item in voice_langs):
-                            engine.setProperty("voice", voice.id)
-                            logger.debug(
-                                f"Выбран голос для {lang_code}: {voice.name}"
-                            )
-                            break
 
-            text_to_speak = text.strip()
-            logger.info(f"Озвучивание: {text_to_speak}")
+class PartialStabilizer:
+    """Выделяет устойчивый префикс частичных результатов Vosk.
+
+    Слово считается устойчивым, если оно совпадает в последних
+    stable_count частичных результатах подряд.
+    """
+
+    def __init__(self, stable_count=2):
+        self.stable_count = max(1, int(stable_count))
+        self.history = []
+        self.stable_words = 0
+
+    def reset(self):
+        self.history = []
+        self.stable_words = 0
+
+    def update(self, partial_text):
+        """Возвращает устойчивый префикс, если он вырос, иначе ""."""
+        self.history.append(partial_text.split())
+        self.history = self.history[-self.stable_count:]
+        if len(self.history) < self.stable_count:
+            return ""
+
+        prefix = self.history[0]
+        for words in self.history[1:]:
+            common = 0
+            for a, b in zip(prefix, words):
+                if a != b:
+                    break
+                common += 1
+            prefix = prefix[:common]
 
-            engine.say(text_to_speak)
-            engine.runAndWait()
-            logger.debug("Озвучка завершена")
+        if len(prefix) <= self.stable_words:
+            return ""
+        self.stable_words = len(prefix)
+        return " ".join(prefix)
+
+
+class StreamingTranslation:
+    """Переводит сегменты распознавания по мере их появления.
+
+    Сегменты переводятся по порядку в отдельном рабочем потоке, поэтому
+    распознавание продолжается, пока идёт перевод. Перевод устойчивого
+    префикса частичного результата показывается как предварительный и
+    заменяется переводом сегмента, когда тот завершён.
+    """
+
+    def __init__(self, translator, source_lang, target_lang,
+                 update_callback=None):
+        self.translator = translator
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.update_callback = update_callback
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.translated_segments = []
+        self.provisional = ""
+        self.partial_version = 0
+        self.cancelled = False
+        self.start_time = time.time()
+        self.first_translation_time = None
+
+    def on_segment(self, text):
+        self.partial_version += 1
+        self.executor.submit(self._translate_segment, text)
+
+    def on_partial(self, text):
+        self.partial_version += 1
+        self.executor.submit(
+            self._translate_partial, text, self.partial_version
+        )
 
+    def _translate_segment(self, text):
+        if self.cancelled:
+            return
+        try:
+            translated = self.translator.translate_text(
+                text, self.source_lang, self.target_lang
+            )
         except Exception as e:
-            logger.error(f"Ошибка озвучки: {e}")
-        finally:
-            try:
-                if engine:
-                    engine.stop()
-            except Exception:
-                pass
-            if finish_callback:
-                finish_callback()
+            logger.error(f"Ошибка потокового перевода: {e}")
+            translated = text
+        self.translated_segments.append(translated)
+        self.provisional = ""
+        self._publish()
+
+    def _translate_partial(self, text, version):
+        if version != self.partial_version:
+            return
+        try:
+            translated = self.translator.translate_text(
+                text, self.source_lang, self.target_lang
+            )
+        except Exception as e:
+            logger.debug(f"Ошибка предварительного перевода: {e}")
+            return
+        if version != self.partial_version:
+            return
+        self.provisional = translated
+        self._publish()
+
+    def _publish(self):
+        # Перевод, начатый до cancel(), не должен попасть в вывод
+        if self.cancelled:
+            return
+        if self.first_translation_time is None:
+            self.first_translation_time = time.time() - self.start_time
+            logger.info(
+                f"Время до первого перевода: "
+                f"{self.first_translation_time:.2f} с"
+            )
+        if self.update_callback:
+            parts = self.translated_segments + [self.provisional]
+            self.update_callback(
+                join_sentences([p for p in parts if p], self.target_lang)
+            )
 
-    threading.Thread(target=worker, daemon=True).start()
+    def cancel(self):
+        """Отменяет перевод без ожидания (например, фраза пустая)."""
+        self.cancelled = True
+        self.partial_version += 1
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def finish(self):
+        """Дожидается перевода всех сегментов и возвращает итог."""
+        self.partial_version += 1
+        self.executor.shutdown(wait=True)
+        result = join_sentences(self.translated_segments, self.target_lang)
+        self.translator.last_translation = result
+        return result
+
+
+class IncrementalTranslation:
+    """Перевод текста при вводе: заново переводятся только изменённые
+    предложения.
+
+    Перевод каждого предложения запоминается (LRU на memo_size записей),
+    поэтому при правке длинного текста стоимость пропорциональна правке,
+    а не длине документа.
+    """
+
+    def __init__(self, translator, source_lang, target_lang, memo_size=512):
+        self.translator = translator
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.memo_size = max(1, int(memo_size))
+        self.memo = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _remember(self, sentence, translated):
+        with self.lock:
+            self.memo[sentence] = translated
+            self.memo.move_to_end(sentence)
+            while len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+
+    def _recall(self, sentence):
+        with self.lock:
+            translated = self.memo.get(sentence)
+            if translated is not None:
+                self.memo.move_to_end(sentence)
+            return translated
+
+    def translate(self, text, cancelled=None):
+        """Переводит текст; None, если cancelled() вернул True."""
+        start_time = time.perf_counter()
+        parts = []
+        translated_count = 0
+        for sentence in split_sentences(text):
+            translated = self._recall(sentence)
+            if translated is None:
+                if cancelled and cancelled():
+                    return None
+                translated = self.translator.translate_text(
+                    sentence, self.source_lang, self.target_lang
+                )
+                self._remember(sentence, translated)
+                translated_count += 1
+            parts.append(translated)
+        logger.debug(
+            f"Перевод при вводе: переведено {translated_count}, "
+            f"из памяти {len(parts) - translated_count} предложений "
+            f"за {(time.perf_counter() - start_time) * 1000:.0f} мс"
+        )
+        return join_sentences(parts, self.target_lang)
 
 
 class Translator:
-    def __init__(self, models_paths):
+    def __init__(
+            self,
+            models_paths,
+            cache_size=2048,
+            cache_path=None,
+            max_resident_models=2,
+            preload_lang=None,
+            preroll_seconds=0.5,
+            device_index=None,
+            sample_rate=None,
+            headless=False,
+            recalibrate=False,
+            gate_decoder=False,
+    ):
+        """headless=True — без микрофона и аудиопотока, только
+        распознавание файлов (recognize_file) и перевод.
+        recalibrate=True — игнорировать сохранённый выбор микрофона.
+        gate_decoder=True — декодировать только речь (см. recognize)."""
         logger.info(f"Инициализация Translator: {list(models_paths.keys())}")
 
-        self.device_index, self.sample_rate = auto_select_microphone()
-        logger.info(
-            f"Выбрано устройство: {self.device_index}, "
-            f"частота: {self.sample_rate}Hz"
-        )
+        self.capture = None
+        if headless:
+            # Модули звука импортируются только при работе с микрофоном,
+            # чтобы пакетный режим не требовал PortAudio
+            self.device_index = None
+            self.sample_rate = sample_rate or 16000
+            self.silence_threshold = 0.01
+        else:
+            from audio_capture import AudioCapture
+            from audio_utils import (
+                auto_select_microphone,
+                get_calibrated_amplification,
+                get_calibrated_silence_threshold
+            )
 
-        # Используем калиброванные параметры
-        self.silence_threshold = get_calibrated_silence_threshold()
-        logger.info(
-            f"Калиброванный порог тишины: {self.silence_threshold:.6f}"
-        )
+            if device_index is None or sample_rate is None:
+                device_index, sample_rate = auto_select_microphone(
+                    recalibrate=recalibrate
+                )
+            self.device_index, self.sample_rate = device_index, sample_rate
+            logger.info(
+                f"Выбрано устройство: {self.device_index}, "
+                f"частота: {self.sample_rate}Hz"
+            )
 
-        self.audio_processor = AudioProcessor(self.sample_rate)
-        self.models = {}
+            # Используем калиброванные параметры
+            self.silence_threshold = get_calibrated_silence_threshold()
+            logger.info(
+                f"Калиброванный порог тишины: {self.silence_threshold:.6f}"
+            )
 
-        for lang_code, model_path in models_paths.items():
-            try:
-                self.models[lang_code] = Model(model_path)
-                logger.info(f"Загружена модель для {lang_code}")
-            except Exception as e:
-                logger.error(f"Ошибка загрузки модели {lang_code}: {e}")
+            # Поток захвата открывается один раз и держит предзапись ~0.5 с
+            self.capture = AudioCapture(
+                self.device_index,
+                self.sample_rate,
+                # Используем калиброванное значение
+                amplification=get_calibrated_amplification(),
+                preroll_seconds=preroll_seconds,
+            )
+            self.capture.start()
 
+        self.audio_processor = AudioProcessor(self.sample_rate)
+
+        # Модели Vosk загружаются по требованию, в памяти держим не более
+        # max_resident_models, вытесняя давно не использованные
+        self.models_paths = dict(models_paths)
+        self.models = OrderedDict()
+        self.max_resident_models = max(1, int(max_resident_models))
+        self.models_lock = threading.Lock()
+        self.model_load_locks = {
+            lang_code: threading.Lock() for lang_code in self.models_paths
+        }
+
+        # Пул распознавателей по (язык, частота), сбрасываемых между фразами
+        self.recognizers = {}
         self.recognizer = None
         self.selected_lang = None
+        self.first_partial_latency = None
+        self.stop_latency = None
+        self.decoder_cpu_time = None
+        self.gate_decoder = gate_decoder
+        self.wake_time = None
         self.last_translation = ""
+        self.cache = (
+            TranslationCache(cache_size, cache_path) if cache_size else None
+        )
         self._init_translations()
 
+        if preload_lang:
+            self.preload_language(preload_lang)
+
     def _init_translations(self):
+        # Модели по отдельным переходам (src, tgt) и маршруты по парам:
+        # пара -> цепочки переходов, самая дешёвая первой
         self.translations = {}
+        self.routes = {}
+        pair_hops = {}
+        lang_codes = ["ru", "fr", "zh", "en"]
         try:
             self.installed_languages = (
                 argostranslate.translate.get_installed_languages()
             )
-            lang_codes = ["ru", "fr", "zh", "en"]
 
             for src in lang_codes:
                 for tgt in lang_codes:
@@ -169,173 +479,550 @@ class Translator:
 
                     if from_lang and to_lang:
                         try:
-                            self.translations[
-                                (src, tgt)
-                            ] = from_lang.get_translation(to_lang)
-                            logger.debug(f"Доступен перевод: {src} -> {tgt}")
+                            translation = from_lang.get_translation(to_lang)
                         except Exception as e:
                             logger.warning(
                                 f"Перевод {src}->{tgt} недоступен: {e}"
                             )
+                            continue
+                        if translation is None:
+                            continue
+                        # Составной перевод Argos раскладываем на переходы,
+                        # чтобы каждый кэшировался и батчился отдельно
+                        hops = []
+                        for hop, model in flatten_translation(translation):
+                            self.translations.setdefault(hop, model)
+                            hops.append(hop)
+                        pair_hops[(src, tgt)] = tuple(hops)
+                        logger.debug(f"Доступен перевод: {src} -> {tgt}")
         except Exception as e:
             logger.error(f"Ошибка инициализации переводов: {e}")
 
-    def set_language(self, lang_code):
-        if lang_code not in self.models:
+        for src in lang_codes:
+            for tgt in lang_codes:
+                if src != tgt:
+                    self._build_route(src, tgt, pair_hops.get((src, tgt)))
+
+    def _build_route(self, src, tgt, hops):
+        """Строит цепочки перевода пары: самая дешёвая первой."""
+        chains = []
+        if hops:
+            chains.append(hops)
+        pivot = ((src, "en"), ("en", tgt))
+        if (src != "en" and tgt != "en" and pivot != hops
+                and all(hop in self.translations for hop in pivot)):
+            chains.append(pivot)
+        chains.sort(key=len)
+        # Для китайского последний вариант — хотя бы перевод на английский
+        if tgt == "zh" and src != "en" and (src, "en") in self.translations:
+            chains.append(((src, "en"),))
+        if not chains:
+            return
+
+        self.routes[(src, tgt)] = chains
+        logger.debug(
+            f"Маршрут {src}->{tgt}: "
+            + " | ".join(format_chain(chain) for chain in chains)
+        )
+
+    def _get_model(self, lang_code):
+        """Возвращает модель Vosk, загружая её при первом обращении."""
+        if lang_code not in self.models_paths:
             raise ValueError(
                 f"Модель распознавания для языка {lang_code} не найдена"
             )
 
-        logger.info(f"Установка языка распознавания: {lang_code}")
-        model = self.models[lang_code]
-        self.recognizer = KaldiRecognizer(model, self.sample_rate)
+        with self.models_lock:
+            model = self.models.get(lang_code)
+            if model is not None:
+                self.models.move_to_end(lang_code)
+                return model
+
+        # Модель попадает в кэш до снятия замка загрузки: иначе поток,
+        # ждавший замок, не найдёт её и загрузит второй раз
+        with self.model_load_locks[lang_code]:
+            with self.models_lock:
+                model = self.models.get(lang_code)
+                if model is not None:
+                    self.models.move_to_end(lang_code)
+                    return model
+
+            start_time = time.time()
+            try:
+                model = Model(self.models_paths[lang_code])
+            except Exception as e:
+                logger.error(f"Ошибка загрузки модели {lang_code}: {e}")
+                raise ValueError(
+                    f"Модель распознавания для языка {lang_code} "
+                    f"не загружена"
+                ) from e
+            logger.info(
+                f"Загружена модель для {lang_code} за "
+                f"{time.time() - start_time:.2f} с"
+            )
+
+            with self.models_lock:
+                self.models[lang_code] = model
+                self.models.move_to_end(lang_code)
+                while len(self.models) > self.max_resident_models:
+                    evicted, _ = self.models.popitem(last=False)
+                    for key in [
+                        k for k in self.recognizers if k[0] == evicted
+                    ]:
+                        del self.recognizers[key]
+                    logger.info(f"Модель {evicted} выгружена из памяти")
+            return model
+
+    def preload_language(self, lang_code, callback=None):
+        """Загружает модель языка в фоновом потоке.
+
+        callback(loaded) вызывается из этого потока по завершении.
+        """
+        def worker():
+            loaded = False
+            try:
+                self._get_model(lang_code)
+                loaded = True
+            except Exception as e:
+                logger.error(f"Ошибка предзагрузки модели {lang_code}: {e}")
+            if callback:
+                callback(loaded)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return thread
+
+    def _get_recognizer(self, lang_code, sample_rate):
+        """Возвращает сброшенный распознаватель из пула и флаг повтора."""
+        model = self._get_model(lang_code)
+        key = (lang_code, sample_rate)
+
+        with self.models_lock:
+            recognizer = self.recognizers.get(key)
+        if recognizer is not None:
+            recognizer.Reset()
+            return recognizer, True
+
+        recognizer = KaldiRecognizer(model, sample_rate)
+        with self.models_lock:
+            self.recognizers[key] = recognizer
+        return recognizer, False
+
+    def set_language(self, lang_code):
+        start_time = time.time()
+        recognizer, reused = self._get_recognizer(
+            lang_code, self.sample_rate
+        )
+        self.recognizer = recognizer
         self.selected_lang = lang_code
+        logger.info(
+            f"Установка языка распознавания: {lang_code} "
+            f"({'из пула' if reused else 'новый распознаватель'}, "
+            f"{(time.time() - start_time) * 1000:.1f} мс)"
+        )
 
     def recognize(
             self,
             max_silence_seconds=3.0,
             silence_threshold=None,
             manual_stop_callback=None,
+            segment_callback=None,
+            partial_callback=None,
+            stable_partial_count=2,
+            press_time=None,
+            stop_event=None,
+            gate_decoder=None,
     ):
-        """Улучшенное распознавание речи."""
+        """Улучшенное распознавание речи.
+
+        В потоковом режиме каждый завершённый сегмент AcceptWaveform
+        передаётся в segment_callback сразу, не дожидаясь конца фразы,
+        а устойчивый префикс частичного результата — в partial_callback.
+
+        press_time — момент нажатия клавиши записи; от него отсчитывается
+        задержка до первого частичного результата.
+
+        stop_event — событие ручной остановки; вместе с wake() оно
+        прерывает ожидание сразу, без опроса manual_stop_callback.
+
+        gate_decoder — декодеру подаются только речевые кадры детектора
+        с короткой подкладкой; конец сегмента и конец фразы определяет
+        детектор по тишине в самом аудио, а не по времени на часах.
+        По умолчанию берётся из self.gate_decoder.
+        """
         if self.recognizer is None:
             raise RuntimeError("Язык распознавания не установлен")
+        if self.capture is None:
+            raise RuntimeError("Микрофон недоступен в режиме headless")
 
         if silence_threshold is None:
             silence_threshold = self.silence_threshold
+        if gate_decoder is None:
+            gate_decoder = self.gate_decoder
 
         last_sound_time = time.time()
         last_text = ""
+        segments = []
+        stabilizer = PartialStabilizer(stable_partial_count)
         recording_start_time = time.time()
+        if press_time is None:
+            press_time = recording_start_time
+        self.first_partial_latency = None
+        self.wake_time = None
 
         logger.info(
             f"Начало распознавания с порогом тишины: {silence_threshold:.6f}"
         )
+        vad = VoiceActivityDetector(
+            self.sample_rate, threshold=silence_threshold
+        )
+        # В декодере есть незавершённый сегмент: тишину ему нужно отдать,
+        # чтобы Vosk сам нашёл конец сегмента
+        decoder_pending = False
+        # Последний пропущенный блок тишины — подкладка перед началом речи
+        skipped_block = None
+        skipped_frames = 0
+        # Тишина по часам: в режиме gate_decoder после начала речи
+        # её заменяет тишина, измеренная детектором
+        wall_clock_silence = max_silence_seconds
+        decoder_cpu = 0.0
+        decoded_frames = 0
+        total_frames = 0
+
+        def decode(chunk):
+            nonlocal decoder_cpu, decoded_frames
+            cpu_start = time.thread_time()
+            accepted = self.recognizer.AcceptWaveform(chunk)
+            decoder_cpu += time.thread_time() - cpu_start
+            decoded_frames += len(chunk) // 2
+            return accepted
+
+        def decoder_call(method):
+            nonlocal decoder_cpu
+            cpu_start = time.thread_time()
+            result = json.loads(method())
+            decoder_cpu += time.thread_time() - cpu_start
+            return result
 
         try:
-            # Упрощаем конфигурацию потока
-            stream_configs = [
-                {'blocksize': 2048, 'latency': 'low'},
-                {'blocksize': 1024, 'latency': 'low'},
-            ]
-
-            stream = None
-            for config in stream_configs:
-                try:
-                    stream = sd.InputStream(
-                        samplerate=self.sample_rate,
-                        blocksize=config['blocksize'],
-                        dtype="int16",
-                        channels=1,
-                        callback=audio_callback,
-                        device=self.device_index,
-                        latency=config['latency']
-                    )
-                    stream.start()
-                    logger.info(
-                        f"Аудиопоток запущен: blocksize={config['blocksize']}"
-                    )
-                    break
-                except Exception as e:
-                    if stream:
-                        stream.close()
-                    logger.debug(f"Ошибка конфигурации {config}: {e}")
-                    continue
-
-            if stream is None:
-                # Последняя попытка с базовыми настройками
-                try:
-                    stream = sd.InputStream(
-                        samplerate=self.sample_rate,
-                        dtype="int16",
-                        channels=1,
-                        callback=audio_callback,
-                        device=self.device_index
-                    )
-                    stream.start()
-                    logger.info(
-                        "Аудиопоток запущен с настройками по умолчанию"
-                    )
-                except Exception as e:
-                    logger.error(f"Не удалось запустить аудиопоток: {e}")
-                    return ""
+            if not self.capture.start():
+                return ""
+            self.capture.begin_utterance()
 
             logger.info("Начало записи речи...")
 
+            # Минимальное время записи перед проверкой тишины и остановки
+            min_recording_time = 1.0
+            max_recording_time = 10.0
+            stop_observed_time = None
+
             while True:
                 current_time = time.time()
                 recording_duration = current_time - recording_start_time
 
-                # Минимальное время записи перед проверкой тишины
-                min_recording_time = 1.0
-                if recording_duration < min_recording_time:
-                    time.sleep(0.1)
-                    continue
-
-                if manual_stop_callback and manual_stop_callback():
-                    logger.info("Ручная остановка записи")
-                    break
-
-                try:
-                    data = audio_queue.get(timeout=0.5)
-                except queue.Empty:
-                    if manual_stop_callback and manual_stop_callback():
-                        logger.info("Ручная остановка при таймауте")
+                if recording_duration >= min_recording_time:
+                    if self._stop_requested(stop_event, manual_stop_callback):
+                        logger.info("Ручная остановка записи")
+                        stop_observed_time = current_time
+                        break
+                    if self._recording_timed_out(
+                            current_time, last_sound_time,
+                            recording_start_time, wall_clock_silence,
+                            max_recording_time):
+                        logger.info("Завершение записи по таймауту")
                         break
+                    if stop_event is None and manual_stop_callback:
+                        # Без события остановки приходится опрашивать
+                        timeout = 0.05
+                    else:
+                        timeout = min(
+                            last_sound_time + wall_clock_silence,
+                            recording_start_time + max_recording_time,
+                        ) - current_time
+                else:
+                    timeout = min_recording_time - recording_duration
+
+                # Просыпаемся по приходу аудио, по сигналу wake() или
+                # к ближайшему сроку проверки
+                data = self.capture.read(timeout=max(0.01, timeout))
+                if data is None:
                     continue
+                current_time = time.time()
+                recording_duration = current_time - recording_start_time
+
+                samples = np.frombuffer(data, dtype=np.int16)
+                total_frames += len(samples)
+                endpoint = False
+                if gate_decoder:
+                    # Декодеру — только речь с подкладкой
+                    voiced, chunk = vad.gate(samples)
+                    if voiced:
+                        wall_clock_silence = max_recording_time
+                    silence = vad.silence_seconds()
+                    endpoint = (
+                        not chunk and decoder_pending
+                        and silence is not None
+                        and silence >= VAD_SEGMENT_ENDPOINT_SECONDS
+                    )
+                    if not chunk and not endpoint:
+                        if (silence is not None
+                                and silence >= max_silence_seconds):
+                            logger.info("Конец речи по детектору")
+                            break
+                        continue
+                else:
+                    # Детектор речи: тишина и решение, кормить ли декодер
+                    voiced, active = vad.process(samples)
+                    if not active and not decoder_pending:
+                        # Чистая тишина при пустом декодере: не декодируем
+                        if skipped_block is not None:
+                            skipped_frames += len(skipped_block) // 2
+                        skipped_block = data
+                        continue
+                    if skipped_block is not None:
+                        decode(skipped_block)
+                        skipped_block = None
+                    chunk = data
+                if voiced:
+                    last_sound_time = current_time
+                    decoder_pending = True
+
+                # Обработка аудиоданных. В режиме gate_decoder конец
+                # сегмента по детектору: FinalResult завершает сегмент,
+                # следующий AcceptWaveform начинает новый
+                if endpoint:
+                    result = decoder_call(self.recognizer.FinalResult)
+                elif decode(chunk):
+                    result = decoder_call(self.recognizer.Result)
+                else:
+                    result = None
 
-                # Анализируем громкость для обнаружения тишины
-                try:
-                    audio_array = np.frombuffer(data, dtype=np.int16)
-                    if len(audio_array) > 0:
-                        rms = np.sqrt(np.mean(audio_array**2)) / 32768.0
-                        if rms >= silence_threshold:
-                            last_sound_time = current_time
-                except Exception as e:
-                    logger.debug(f"Ошибка анализа громкости: {e}")
-
-                # Обработка аудиоданных
-                if self.recognizer.AcceptWaveform(data):
-                    result = json.loads(self.recognizer.Result())
+                if result is not None:
                     text = result.get("text", "").strip()
+                    stabilizer.reset()
+                    decoder_pending = False
                     if text:
+                        if self.first_partial_latency is None:
+                            self._log_first_partial(press_time)
                         last_text = text
+                        segments.append(text)
                         last_sound_time = current_time
                         logger.info(f"Распознано: {text}")
+                        if segment_callback:
+                            segment_callback(text)
                 else:
-                    partial = json.loads(self.recognizer.PartialResult())
+                    partial = decoder_call(self.recognizer.PartialResult)
                     partial_text = partial.get("partial", "").strip()
                     if partial_text:
+                        decoder_pending = True
+                        if self.first_partial_latency is None:
+                            self._log_first_partial(press_time)
                         last_text = partial_text
                         last_sound_time = current_time
                         if len(partial_text) > 2:
                             logger.debug(f"Частично: {partial_text}")
+                        if partial_callback:
+                            stable_text = stabilizer.update(partial_text)
+                            if stable_text:
+                                partial_callback(stable_text)
 
                 # Проверка условий остановки
-                silence_timeout = (
-                    current_time - last_sound_time
-                ) > max_silence_seconds
-                # Макс. время записи
-                recording_timeout = recording_duration > 10.0
-
-                if silence_timeout or recording_timeout:
+                if recording_duration >= min_recording_time and (
+                        self._recording_timed_out(
+                            current_time, last_sound_time,
+                            recording_start_time, wall_clock_silence,
+                            max_recording_time)):
                     logger.info("Завершение записи по таймауту")
                     break
 
-            stream.stop()
-            stream.close()
+            if skipped_block is not None:
+                skipped_frames += len(skipped_block) // 2
+            if skipped_frames:
+                logger.info(
+                    f"Тишина без декодирования: "
+                    f"{skipped_frames / self.sample_rate:.1f} с"
+                )
 
             # Получаем финальный результат
-            final_result = json.loads(self.recognizer.FinalResult())
+            final_result = decoder_call(self.recognizer.FinalResult)
             final_text = final_result.get("text", "").strip()
+            if final_text:
+                segments.append(final_text)
+                if segment_callback:
+                    segment_callback(final_text)
+
+            self.decoder_cpu_time = decoder_cpu
+            logger.info(
+                f"Декодер: {decoder_cpu * 1000:.0f} мс CPU, подано "
+                f"{decoded_frames / self.sample_rate:.1f} с из "
+                f"{total_frames / self.sample_rate:.1f} с аудио"
+            )
 
-            result_text = final_text or last_text
+            if stop_observed_time is not None:
+                stop_time = self.wake_time or stop_observed_time
+                self.stop_latency = time.time() - min(
+                    stop_time, stop_observed_time
+                )
+                logger.info(
+                    f"Задержка от остановки до результата: "
+                    f"{self.stop_latency * 1000:.0f} мс"
+                )
+
+            result_text = " ".join(segments) or last_text
             logger.info(f"Финальный результат: '{result_text}'")
             return result_text
 
         except Exception as e:
             logger.error(f"Ошибка при распознавании: {e}")
             return ""
+        finally:
+            self.capture.end_utterance()
+
+    def set_amplification(self, factor):
+        """Устанавливает усиление микрофона этой сессии."""
+        if self.capture:
+            self.capture.set_amplification(factor)
+
+    def recognize_file(self, path, lang_code, chunk_frames=8000):
+        """Распознаёт WAV-файл быстрее реального времени.
+
+        Возвращает список сегментов {"start", "end", "text"} (секунды).
+        Поддерживается 16-битный PCM; многоканальный звук сводится в моно.
+        """
+        with wave.open(str(path), "rb") as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(
+                    f"{path}: поддерживается только 16-битный PCM"
+                )
+            channels = wav.getnchannels()
+            sample_rate = wav.getframerate()
+            total_frames = wav.getnframes()
+
+            recognizer, _ = self._get_recognizer(lang_code, sample_rate)
+            recognizer.SetWords(True)
+
+            segments = []
+            start_time = time.time()
+            while True:
+                data = wav.readframes(chunk_frames)
+                if not data:
+                    break
+                if channels > 1:
+                    data = downmix(
+                        np.frombuffer(data, dtype=np.int16), channels
+                    ).tobytes()
+                if recognizer.AcceptWaveform(data):
+                    self._append_file_segment(
+                        segments, recognizer.Result()
+                    )
+            self._append_file_segment(segments, recognizer.FinalResult())
+
+        elapsed = time.time() - start_time
+        duration = total_frames / sample_rate if sample_rate else 0.0
+        logger.info(
+            f"Распознан файл {path}: {duration:.1f} с аудио за "
+            f"{elapsed:.1f} с (x{duration / max(elapsed, 1e-6):.1f})"
+        )
+        return segments
+
+    @staticmethod
+    def _append_file_segment(segments, result_json):
+        result = json.loads(result_json)
+        text = result.get("text", "").strip()
+        if not text:
+            return
+        words = result.get("result") or []
+        segments.append({
+            "start": words[0]["start"] if words else None,
+            "end": words[-1]["end"] if words else None,
+            "text": text,
+        })
+
+    def wake(self):
+        """Будит цикл распознавания, например после запроса остановки."""
+        self.wake_time = time.time()
+        if self.capture:
+            self.capture.wake()
+
+    @staticmethod
+    def _stop_requested(stop_event, manual_stop_callback):
+        if stop_event is not None and stop_event.is_set():
+            return True
+        return bool(manual_stop_callback and manual_stop_callback())
+
+    @staticmethod
+    def _recording_timed_out(current_time, last_sound_time,
+                             recording_start_time, max_silence_seconds,
+                             max_recording_time):
+        silence_timeout = (
+            current_time - last_sound_time
+        ) > max_silence_seconds
+        recording_timeout = (
+            current_time - recording_start_time
+        ) > max_recording_time
+        return silence_timeout or recording_timeout
+
+    def _log_first_partial(self, press_time):
+        self.first_partial_latency = time.time() - press_time
+        logger.info(
+            f"Задержка от нажатия до первого результата: "
+            f"{self.first_partial_latency * 1000:.0f} мс"
+        )
+
+    def _translate_pair(self, text, source_lang, target_lang):
+        """Перевод одной моделью пары языков с использованием кэша."""
+        if self.cache:
+            cached = self.cache.get(text, source_lang, target_lang)
+            if cached is not None:
+                logger.debug(f"Кэш перевода {source_lang}->{target_lang}")
+                return cached
+
+        translation = self.translations[(source_lang, target_lang)]
+        translated_text = translation.translate(text)
+        if self.cache:
+            self.cache.put(text, source_lang, target_lang, translated_text)
+        return translated_text
+
+    def _translate_chain(self, text, chain):
+        for source_lang, target_lang in chain:
+            text = self._translate_pair(text, source_lang, target_lang)
+        return text
+
+    def _translate_routed(self, items, source_lang, target_lang,
+                          translate_chain):
+        """Переводит элементы по маршруту пары с запасными цепочками.
+
+        Следующая цепочка используется только для элементов, которые
+        не удалось перевести предыдущей (ошибка или, для китайского,
+        испорченный результат); общие переходы берутся из кэша.
+        """
+        chains = self.routes.get((source_lang, target_lang))
+        if chains is None:
+            logger.warning(f"Перевод {source_lang}->{target_lang} недоступен")
+            return list(items)
+
+        results = [None] * len(items)
+        pending = list(range(len(items)))
+        for chain in chains:
+            if not pending:
+                break
+            try:
+                translated = translate_chain(
+                    [items[i] for i in pending], chain
+                )
+            except Exception as e:
+                logger.error(f"Ошибка перевода {format_chain(chain)}: {e}")
+                continue
+            for i, translated_text in zip(pending, translated):
+                if target_lang != "zh" or is_valid_translation(
+                        translated_text):
+                    results[i] = translated_text
+            pending = [i for i in pending if results[i] is None]
+
+        return [
+            result if result is not None else item
+            for result, item in zip(results, items)
+        ]
 
     def translate_text(self, text, source_lang, target_lang):
         """Перевод текста между языками."""
@@ -347,74 +1034,162 @@ class Translator:
 
         logger.info(f"Перевод {source_lang}->{target_lang}: '{text}'")
 
-        if target_lang == "zh":
-            try:
-                translation = self.translations.get((source_lang, target_lang))
-                if translation:
-                    translated_text = translation.translate(text)
-                    if (len(translated_text.strip()) > 0 and
-                            not any(c in translated_text for c in ['�', ''])):
-                        self.last_translation = translated_text
-                        logger.info(f"Корректный перевод: '{translated_text}'")
-                        return translated_text
-
-                if source_lang != "en":
-                    trans1 = self.translations.get((source_lang, "en"))
-                    trans2 = self.translations.get(("en", target_lang))
-                    if trans1 and trans2:
-                        english_text = trans1.translate(text)
-                        translated_text = trans2.translate(english_text)
-                        if len(translated_text.strip()) > 0:
-                            self.last_translation = translated_text
-                            logger.info(
-                                f"Перевод через EN: '{translated_text}'"
-                            )
-                            return translated_text
-
-                if source_lang != "en":
-                    trans = self.translations.get((source_lang, "en"))
-                    if trans:
-                        return trans.translate(text)
-                return text
-
-            except Exception as e:
-                logger.error(f"Ошибка перевода на китайский: {e}")
-                return text
-
-        translation = self.translations.get((source_lang, target_lang))
-        if translation:
-            try:
-                translated_text = translation.translate(text)
-                self.last_translation = translated_text
-                logger.info(f"Результат перевода: '{translated_text}'")
-                return translated_text
-            except Exception as e:
-                logger.error(f"Ошибка прямого перевода: {e}")
-
-        if source_lang != "en" and target_lang != "en":
-            trans1 = self.translations.get((source_lang, "en"))
-            trans2 = self.translations.get(("en", target_lang))
-
-            if trans1 and trans2:
-                try:
-                    english_text = trans1.translate(text)
-                    translated_text = trans2.translate(english_text)
-                    self.last_translation = translated_text
-                    logger.info(
-                        f"Перевод через английский: '{translated_text}'"
+        translated_text = self._translate_routed(
+            [text], source_lang, target_lang,
+            lambda texts, chain: [self._translate_chain(texts[0], chain)]
+        )[0]
+        self.last_translation = translated_text
+        logger.info(f"Результат перевода: '{translated_text}'")
+        return translated_text
+
+    def _translate_pair_batch(self, sentences, source_lang, target_lang,
+                              max_batch_size):
+        """Пакетный перевод одной моделью: кэш, дедупликация, бакеты."""
+        results = {}
+        missing = []
+        for sentence in dict.fromkeys(sentences):
+            cached = None
+            if self.cache:
+                cached = self.cache.get(sentence, source_lang, target_lang)
+            if cached is None:
+                missing.append(sentence)
+            else:
+                results[sentence] = cached
+
+        translation = self.translations[(source_lang, target_lang)]
+        # Близкие по длине предложения в одном батче — меньше паддинга
+        missing.sort(key=len)
+        for i in range(0, len(missing), max_batch_size):
+            bucket = missing[i:i + max_batch_size]
+            translated = translate_sentences_batched(translation, bucket)
+            for sentence, translated_text in zip(bucket, translated):
+                results[sentence] = translated_text
+                if self.cache:
+                    self.cache.put(
+                        sentence, source_lang, target_lang, translated_text
                     )
-                    return translated_text
-                except Exception as e:
-                    logger.error(f"Ошибка перевода через английский: {e}")
+        return [results[sentence] for sentence in sentences]
 
-        logger.warning(f"Перевод {source_lang}->{target_lang} недоступен")
-        self.last_translation = text
-        return text
+    def _translate_chain_batch(self, sentences, chain, max_batch_size):
+        for source_lang, target_lang in chain:
+            sentences = self._translate_pair_batch(
+                sentences, source_lang, target_lang, max_batch_size
+            )
+        return sentences
+
+    def translate_batch(self, texts, source_lang, target_lang,
+                        max_batch_size=32):
+        """Пакетный перевод списка текстов.
+
+        Тексты делятся на предложения, одинаковые предложения переводятся
+        один раз, а модель получает их батчами по длине. Маршрут (прямой
+        перевод, через английский, запасной вариант для zh) тот же, что
+        у translate_text.
+        """
+        texts = list(texts)
+        if source_lang == target_lang:
+            return texts
+
+        split = [split_sentences(text) for text in texts]
+        unique = list(dict.fromkeys(
+            sentence for sentences in split for sentence in sentences
+        ))
+        start_time = time.time()
+        translated = dict(zip(unique, self._translate_routed(
+            unique, source_lang, target_lang,
+            lambda sentences, chain: self._translate_chain_batch(
+                sentences, chain, max_batch_size
+            )
+        )))
+        logger.info(
+            f"Пакетный перевод {source_lang}->{target_lang}: "
+            f"{len(texts)} текстов, {len(unique)} уникальных предложений "
+            f"за {time.time() - start_time:.2f} с"
+        )
+
+        results = [
+            join_sentences([translated[s] for s in sentences], target_lang)
+            for sentences in split
+        ]
+        if results:
+            self.last_translation = results[-1]
+        return results
 
     def speak(self, text, lang_code=None, finish_callback=None):
         """Публичный метод для озвучивания текста."""
         speak_text(text, lang_code, finish_callback)
 
+    def translate_and_speak(self, text, source_lang, target_lang,
+                            sentence_callback=None, finish_callback=None,
+                            cancelled=None):
+        """Переводит текст по предложениям и озвучивает каждое сразу.
+
+        Озвучка первого предложения идёт, пока переводятся следующие.
+        sentence_callback получает накопленный перевод после каждого
+        предложения. finish_callback вызывается из потока озвучки, когда
+        отзвучит (или будет отброшено) всё поставленное в очередь, даже
+        если последнее предложение оказалось слишком коротким для озвучки.
+        Если озвучку прервали (stop_speaking), оставшиеся предложения
+        переводятся, но не озвучиваются. cancelled() проверяется перед
+        каждым предложением: если он вернул True, перевод прекращается.
+        Возвращает перевод (при отмене — неполный).
+        """
+        worker = get_speech_worker()
+        generation = worker.generation
+        start_time = time.perf_counter()
+        first_audio = []
+
+        def on_audio_start():
+            if not first_audio:
+                first_audio.append(time.perf_counter() - start_time)
+                logger.info(
+                    f"Время до первого звука: {first_audio[0]:.2f} с"
+                )
+
+        sentences = split_sentences(text)
+        parts = []
+        speaking = True
+        for number, sentence in enumerate(sentences, 1):
+            if cancelled and cancelled():
+                logger.info(
+                    f"Перевод отменён после {number - 1} из "
+                    f"{len(sentences)} предложений"
+                )
+                speaking = False
+                break
+            parts.append(self.translate_text(sentence, source_lang,
+                                             target_lang))
+            if sentence_callback:
+                sentence_callback(join_sentences(parts, target_lang))
+            speaking = speaking and worker.generation == generation
+            if speaking:
+                # Поколение запомнено до перевода: cancel() между
+                # проверкой и постановкой в очередь тоже отбросит фразу
+                worker.speak(
+                    parts[-1], target_lang, start_callback=on_audio_start,
+                    generation=generation,
+                )
+
+        if finish_callback:
+            worker.notify(finish_callback)
+        translated = join_sentences(parts, target_lang)
+        if len(parts) < len(sentences):
+            return translated
+        self.last_translation = translated
+        logger.info(
+            f"Перевод по предложениям: {len(sentences)} предложений "
+            f"за {time.perf_counter() - start_time:.2f} с"
+        )
+        return translated
+
+    def stop_speaking(self):
+        """Прерывает текущую озвучку и очищает очередь."""
+        get_speech_worker().cancel()
+
     def stop(self):
         """Остановка всех процессов."""
-        pass
+        if self.capture:
+            self.capture.close()
+        get_speech_worker().close()
+        if self.cache:
+            self.cache.save()
@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from logger_setup import logger
+
+
+def normalize_text(text):
+    """Нормализует текст для ключа кэша (схлопывает пробелы)."""
+    return " ".join(text.split())
+
+
+class TranslationCache:
+    """Ограниченный LRU-кэш переводов с сохранением на диск.
+
+    Ключ — (исходный язык, целевой язык, нормализованный текст).
+    Кэшируется каждая пара модели отдельно, поэтому результат ru->en
+    переиспользуется в переводах ru->fr и ru->zh через английский.
+    """
+
+    def __init__(self, max_size=2048, path=None):
+        self.max_size = max(1, int(max_size))
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        if path:
+            self.load()
+
+    def get(self, text, source_lang, target_lang):
+        key = (source_lang, target_lang, normalize_text(text))
+        with self.lock:
+            translated = self.entries.get(key)
+            if translated is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return translated
+
+    def put(self, text, source_lang, target_lang, translated):
+        key = (source_lang, target_lang, normalize_text(text))
+        with self.lock:
+            self.entries[key] = translated
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def stats(self):
+        """Возвращает счётчики попаданий и промахов."""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def load(self):
+        """Загружает кэш с диска, если файл существует."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                rows = json.load(f)
+            with self.lock:
+                for src, tgt, text, translated in rows[-self.max_size:]:
+                    self.entries[(src, tgt, text)] = translated
+            logger.info(
+                f"Загружен кэш переводов: {len(self.entries)} записей"
+            )
+        except Exception as e:
+            logger.error(f"Ошибка загрузки кэша переводов: {e}")
+
+    def save(self):
+        """Сохраняет кэш на диск в порядке LRU (атомарно)."""
+        if not self.path or not self.dirty:
+            return
+        try:
+            with self.lock:
+                rows = [
+                    [src, tgt, text, translated]
+                    for (src, tgt, text), translated in self.entries.items()
+                ]
+                self.dirty = False
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(rows, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            stats = self.stats()
+            logger.info(
+                f"Кэш переводов сохранён: {stats['size']} записей, "
+                f"попаданий {stats['hits']}, промахов {stats['misses']}"
+            )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения кэша переводов: {e}")
@@ -0,0 +1,437 @@
+import os
+import queue
+import re
+import threading
+import time
+from collections.abc import Iterable
+
+from logger_setup import logger
+from tts_cache import SpeechCache
+
+
+# Языки интерфейса, для которых индекс голосов строится всегда
+DEFAULT_LANGUAGES = ("ru", "fr", "zh", "en")
+# Кусок проигрывания: cancel() срабатывает не позже чем через столько
+PLAYBACK_CHUNK_SECONDS = 0.1
+# Названия языков в именах голосов (SAPI5 часто не заполняет languages)
+VOICE_NAME_HINTS = {
+    "ru": ("russian",),
+    "fr": ("french", "français"),
+    "zh": ("chinese", "mandarin", "cantonese"),
+    "en": ("english",),
+}
+# Порядок предпочтения: заявленный язык, локаль в id/имени, название языка
+RANK_DECLARED, RANK_LOCALE, RANK_NAME = 0, 1, 2
+# Локаль вида ru-RU / ru_RU в id или имени голоса (совпадения перекрываются)
+LOCALE_RE = re.compile(r"(?<![a-z])(?=([a-z]{2})[-_][a-z]{2}(?![a-z]))")
+
+
+def decode_voice_languages(voice):
+    """Языки голоса pyttsx3 в нижнем регистре (bytes декодируются)."""
+    voice_langs = []
+    for lang in getattr(voice, "languages", []):
+        if isinstance(lang, bytes):
+            try:
+                voice_langs.append(lang.decode("utf-8").lower())
+            except Exception:
+                pass
+        else:
+            voice_langs.append(str(lang).lower())
+    return voice_langs
+
+
+def base_language(lang):
+    """'ru_RU', 'RU-ru', '\x05ru' -> 'ru'."""
+    match = re.search(r"[a-z]{2,3}", lang.lower())
+    return match.group(0) if match else ""
+
+
+def voice_language_ranks(voice, known_languages):
+    """Языки голоса с рангом, по которому они определены.
+
+    По локали в id/имени учитываются только известные языки: иначе
+    служебные части id (например, TTS_MS) принимались бы за языки.
+    """
+    ranks = {}
+
+    def add(lang, rank):
+        if lang and rank < ranks.get(lang, RANK_NAME + 1):
+            ranks[lang] = rank
+
+    for lang in decode_voice_languages(voice):
+        add(base_language(lang), RANK_DECLARED)
+    ident = " ".join(
+        str(getattr(voice, attr, "")) for attr in ("id", "name")
+    ).lower()
+    for match in LOCALE_RE.finditer(ident):
+        if match.group(1) in known_languages:
+            add(match.group(1), RANK_LOCALE)
+    for lang, hints in VOICE_NAME_HINTS.items():
+        if any(hint in ident for hint in hints):
+            add(lang, RANK_NAME)
+    return ranks
+
+
+def find_override(voices, wanted):
+    """Голос из настройки: точный id или подстрока id/имени."""
+    wanted_lower = wanted.lower()
+    for voice in voices:
+        if voice.id == wanted:
+            return voice.id
+    for voice in voices:
+        ident = f"{voice.id} {getattr(voice, 'name', '')}".lower()
+        if wanted_lower in ident:
+            return voice.id
+    return None
+
+
+def build_voice_index(voices, languages=DEFAULT_LANGUAGES, overrides=None):
+    """Строит индекс язык -> id голоса за один проход по голосам.
+
+    В индекс попадают переданные языки и все языки установленных
+    голосов. Среди голосов одного языка побеждает меньший ранг, при
+    равенстве — порядок голосов в системе. overrides задаёт голос для
+    языка явно: строку или список вариантов в порядке предпочтения
+    (id или подстрока id/имени); ненайденные варианты пропускаются.
+    """
+    voices = list(voices) if isinstance(voices, Iterable) else []
+    candidates = {lang: [] for lang in languages}
+    known_languages = set(languages) | set(VOICE_NAME_HINTS)
+    for voice in voices:
+        known_languages.update(
+            base_language(lang) for lang in decode_voice_languages(voice)
+        )
+    for order, voice in enumerate(voices):
+        ranks = voice_language_ranks(voice, known_languages)
+        for lang, rank in ranks.items():
+            candidates.setdefault(lang, []).append((rank, order, voice.id))
+
+    index = {
+        lang: min(found)[2] if found else None
+        for lang, found in candidates.items()
+    }
+
+    for lang, wanted in (overrides or {}).items():
+        if isinstance(wanted, str):
+            wanted = [wanted]
+        for variant in wanted:
+            voice_id = find_override(voices, variant)
+            if voice_id is not None:
+                index[lang] = voice_id
+                break
+        else:
+            logger.warning(f"Голос из настроек для {lang} не найден")
+
+    missing = [lang for lang in languages if index.get(lang) is None]
+    if missing:
+        logger.warning(
+            f"Нет голосов для языков: {', '.join(missing)}, "
+            f"будет голос по умолчанию"
+        )
+    return index
+
+
+class SpeechWorker:
+    """Долгоживущий поток озвучки с одним движком pyttsx3.
+
+    Движок и индекс голосов создаются один раз при старте потока,
+    запросы идут через очередь и выполняются по порядку. cancel()
+    прерывает текущую фразу и отбрасывает очередь; finish_callback
+    вызывается для каждого запроса ровно один раз, в том числе
+    для отменённых.
+
+    Если включён кэш, фраза синтезируется в WAV (save_to_file) и
+    проигрывается через sounddevice, а готовый звук переиспользуется
+    для повторов. Если драйвер не умеет писать WAV, речь идёт напрямую
+    через engine.say.
+    """
+
+    def __init__(self, rate=150, volume=1.0, languages=DEFAULT_LANGUAGES,
+                 voice_overrides=None, cache_dir=None, cache_memory_mb=32,
+                 cache_disk_mb=200):
+        self.rate = rate
+        self.volume = volume
+        self.languages = tuple(languages)
+        self.voice_overrides = dict(voice_overrides or {})
+        self.cache_options = {
+            "path": cache_dir,
+            "max_memory_bytes": int(cache_memory_mb * (1 << 20)),
+            "max_disk_bytes": int(cache_disk_mb * (1 << 20)),
+        }
+        self.cache = None
+        self.file_synthesis = True
+        self.requests = queue.Queue()
+        self.voice_index = {}
+        # Голос движка при запуске: для языков без своего голоса
+        self.default_voice = None
+        self.current_voice = None
+        self.engine = None
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        # Поколение запросов: cancel() делает устаревшими все прежние
+        self.generation = 0
+        self.speaking_generation = None
+
+    def configure(self, languages=None, voice_overrides=None,
+                  cache_dir=None, cache_memory_mb=None, cache_disk_mb=None):
+        """Задаёт языки, голоса и кэш из настроек (до запуска потока)."""
+        if languages is not None:
+            self.languages = tuple(languages)
+        if voice_overrides is not None:
+            self.voice_overrides = dict(voice_overrides)
+        if cache_dir is not None:
+            self.cache_options["path"] = cache_dir
+        if cache_memory_mb is not None:
+            self.cache_options["max_memory_bytes"] = int(
+                cache_memory_mb * (1 << 20)
+            )
+        if cache_disk_mb is not None:
+            self.cache_options["max_disk_bytes"] = int(
+                cache_disk_mb * (1 << 20)
+            )
+
+    def start(self):
+        """Заранее запускает поток: движок и индекс готовы к первой фразе."""
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name="tts", daemon=True
+                )
+                self.thread.start()
+
+    def speak(self, text, lang_code=None, finish_callback=None,
+              start_callback=None, generation=None):
+        """Ставит фразу в очередь озвучки.
+
+        start_callback вызывается из потока озвучки, когда фраза
+        начинает звучать. generation — поколение, которое вызывающий
+        запомнил раньше: если cancel() случился после этого, фраза
+        отбрасывается, а не звучит под новым поколением.
+        """
+        if not text or len(text.strip()) < 2:
+            logger.warning("Озвучка пропущена: короткий текст")
+            if finish_callback:
+                finish_callback()
+            return
+        if generation is None:
+            generation = self.generation
+        self._ensure_thread()
+        self.requests.put((
+            generation, text.strip(), lang_code, finish_callback,
+            start_callback, time.perf_counter(),
+        ))
+
+    def notify(self, callback):
+        """Вызывает callback, когда дойдёт очередь: после всех фраз,
+        поставленных раньше (озвученных или отброшенных cancel)."""
+        self._ensure_thread()
+        self.requests.put((
+            self.generation, None, None, callback, None, time.perf_counter(),
+        ))
+
+    def cancel(self):
+        """Прерывает текущую фразу и отбрасывает ожидающие."""
+        self.generation += 1
+        logger.info("Озвучка прервана")
+
+    def close(self):
+        """Отменяет озвучку и завершает поток."""
+        self.generation += 1
+        if self.thread is not None and self.thread.is_alive():
+            self.requests.put(None)
+            self.thread.join(timeout=2.0)
+        if self.cache is not None:
+            stats = self.cache.stats()
+            logger.info(
+                f"Кэш озвучки: попаданий в памяти {stats['hits']}, "
+                f"на диске {stats['disk_hits']}, промахов {stats['misses']} "
+                f"(доля попаданий {stats['hit_rate']:.0%})"
+            )
+
+    def _on_word(self, name, location, length):
+        # engine.stop() безопасно вызывать только из цикла самого движка
+        if (self.speaking_generation != self.generation
+                and self.engine is not None):
+            self.engine.stop()
+
+    def _init_engine(self):
+        try:
+            import pyttsx3
+
+            start_time = time.perf_counter()
+            engine = pyttsx3.init()
+            engine.setProperty("rate", self.rate)
+            engine.setProperty("volume", self.volume)
+            engine.connect("started-word", self._on_word)
+            self.default_voice = engine.getProperty("voice")
+            self.current_voice = self.default_voice
+            logger.info(
+                f"Движок озвучки готов за "
+                f"{(time.perf_counter() - start_time) * 1000:.0f} мс"
+            )
+            return engine
+        except Exception as e:
+            logger.error(f"Ошибка инициализации озвучки: {e}")
+            return None
+
+    def _build_index(self):
+        try:
+            start_time = time.perf_counter()
+            self.voice_index = build_voice_index(
+                self.engine.getProperty("voices"),
+                self.languages,
+                self.voice_overrides,
+            )
+            logger.info(
+                f"Индекс голосов построен "
+                f"(языков: {len(self.voice_index)}) за "
+                f"{(time.perf_counter() - start_time) * 1000:.0f} мс"
+            )
+            for lang in self.languages:
+                logger.debug(
+                    f"Голос для {lang}: {self.voice_index.get(lang)}"
+                )
+        except Exception as e:
+            logger.error(f"Ошибка построения индекса голосов: {e}")
+
+    def _select_voice(self, lang_code):
+        voice_id = None
+        if lang_code:
+            voice_id = self.voice_index.get(base_language(lang_code))
+        # Без своего голоса — голос по умолчанию, а не голос прошлой фразы
+        if voice_id is None:
+            voice_id = self.default_voice
+        if voice_id is not None and voice_id != self.current_voice:
+            self.engine.setProperty("voice", voice_id)
+            self.current_voice = voice_id
+
+    def _init_cache(self):
+        options = self.cache_options
+        if not options["max_memory_bytes"] and not options["max_disk_bytes"]:
+            return None
+        try:
+            return SpeechCache(**options)
+        except Exception as e:
+            logger.error(f"Ошибка создания кэша озвучки: {e}")
+            return None
+
+    def _synthesize(self, text, lang_code):
+        """Звук фразы из кэша или свежий синтез в WAV; None — без кэша."""
+        if self.cache is None or not self.file_synthesis:
+            return None
+        key = self.cache.make_key(
+            text, base_language(lang_code or ""), self.current_voice,
+            self.rate
+        )
+        audio = self.cache.get(key)
+        if audio is not None:
+            return audio
+
+        synthesized_path = self.cache.temp_path(key)
+        try:
+            start_time = time.perf_counter()
+            self.engine.save_to_file(text, synthesized_path)
+            self.engine.runAndWait()
+            if self.speaking_generation != self.generation:
+                # Синтез прерван: неполный файл в кэш не попадает
+                os.remove(synthesized_path)
+                return None
+            audio = self.cache.store(key, synthesized_path)
+            logger.debug(
+                f"Синтез фразы занял "
+                f"{(time.perf_counter() - start_time) * 1000:.0f} мс"
+            )
+            return audio
+        except Exception as e:
+            # Например, драйвер пишет не WAV: дальше говорим напрямую
+            logger.warning(f"Синтез в файл недоступен: {e}")
+            self.file_synthesis = False
+            try:
+                os.remove(synthesized_path)
+            except OSError:
+                pass
+            return None
+
+    def _play(self, samples, sample_rate):
+        """Проигрывает отсчёты; cancel() прерывает между кусками."""
+        import sounddevice as sd
+        from audio_utils import close_stream, open_stream
+
+        stream = open_stream(
+            sd.OutputStream,
+            samplerate=sample_rate,
+            channels=1 if samples.ndim == 1 else samples.shape[1],
+            dtype=samples.dtype.name,
+        )
+        try:
+            step = max(1, int(PLAYBACK_CHUNK_SECONDS * sample_rate))
+            for start in range(0, len(samples), step):
+                if self.speaking_generation != self.generation:
+                    break
+                stream.write(samples[start:start + step])
+        finally:
+            close_stream(stream)
+
+    def _say(self, text, lang_code, start_callback, queued_at):
+        self._select_voice(lang_code)
+        logger.info(f"Озвучивание: {text}")
+        audio = self._synthesize(text, lang_code)
+        if self.speaking_generation != self.generation:
+            return
+        logger.debug(
+            f"Озвучка начата через "
+            f"{(time.perf_counter() - queued_at) * 1000:.0f} мс "
+            f"после запроса"
+        )
+        if start_callback:
+            start_callback()
+        if audio is not None:
+            self._play(*audio)
+        else:
+            self.engine.say(text)
+            self.engine.runAndWait()
+        logger.debug("Озвучка завершена")
+
+    def _run(self):
+        self.engine = self._init_engine()
+        if self.engine is not None:
+            self._build_index()
+            self.cache = self._init_cache()
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            (generation, text, lang_code, finish_callback, start_callback,
+             queued_at) = request
+            try:
+                if (text is not None and generation == self.generation
+                        and self.engine is not None):
+                    self.speaking_generation = generation
+                    self._say(text, lang_code, start_callback, queued_at)
+            except Exception as e:
+                logger.error(f"Ошибка озвучки: {e}")
+            finally:
+                if finish_callback:
+                    finish_callback()
+        if self.engine is not None:
+            try:
+                self.engine.stop()
+            except Exception:
+                pass
+
+
+_speech_worker = None
+_speech_worker_lock = threading.Lock()
+
+
+def get_speech_worker():
+    """Общий для процесса поток озвучки (создаётся при первом вызове)."""
+    global _speech_worker
+
+    with _speech_worker_lock:
+        if _speech_worker is None:
+            _speech_worker = SpeechWorker()
+        return _speech_worker
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+import wave
+from collections import OrderedDict
+
+import numpy as np
+
+from logger_setup import logger
+
+
+def read_wav(path):
+    """Читает 16-битный WAV: (отсчёты int16, частота)."""
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{path}: нужен 16-битный WAV")
+        channels = wav.getnchannels()
+        sample_rate = wav.getframerate()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), np.int16)
+    if channels > 1:
+        samples = samples.reshape(-1, channels)
+    return samples, sample_rate
+
+
+class SpeechCache:
+    """Кэш синтезированной речи в памяти и на диске.
+
+    Ключ — хэш (текст, язык, голос, скорость). В памяти хранятся
+    отсчёты последних фраз в пределах max_memory_bytes (LRU), на диске —
+    WAV-файлы в каталоге path в пределах max_disk_bytes; при превышении
+    удаляются файлы, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, path="tts_cache", max_memory_bytes=32 << 20,
+                 max_disk_bytes=200 << 20):
+        self.path = path
+        self.max_memory_bytes = max(0, int(max_memory_bytes))
+        self.max_disk_bytes = max(0, int(max_disk_bytes))
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self.disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    @staticmethod
+    def make_key(text, lang_code, voice_id, rate):
+        raw = "\x1f".join(
+            [" ".join(text.split()), lang_code or "", voice_id or "",
+             str(rate)]
+        )
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _file_path(self, key):
+        return os.path.join(self.path, key + ".wav")
+
+    def temp_path(self, key):
+        """Куда синтезировать новую фразу перед store()."""
+        directory = self.path or "."
+        return os.path.join(directory, key + ".tmp.wav")
+
+    def _disk_files(self):
+        files = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".wav") or name.endswith(".tmp.wav"):
+                continue
+            file_path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            files.append((file_path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _remember(self, key, audio):
+        size = audio[0].nbytes
+        if size > self.max_memory_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= old[0].nbytes
+        self.entries[key] = audio
+        self.memory_bytes += size
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory_bytes -= evicted[0].nbytes
+
+    def get(self, key):
+        """Возвращает (отсчёты, частота) или None."""
+        with self.lock:
+            audio = self.entries.get(key)
+            if audio is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return audio
+
+        if self.path and os.path.exists(self._file_path(key)):
+            try:
+                file_path = self._file_path(key)
+                audio = read_wav(file_path)
+                # mtime — время последнего обращения для вытеснения
+                os.utime(file_path)
+                with self.lock:
+                    self._remember(key, audio)
+                    self.disk_hits += 1
+                return audio
+            except Exception as e:
+                logger.debug(f"Ошибка чтения кэша озвучки: {e}")
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def store(self, key, synthesized_path):
+        """Забирает синтезированный WAV в кэш и возвращает его отсчёты."""
+        audio = read_wav(synthesized_path)
+        with self.lock:
+            self._remember(key, audio)
+
+        if not self.path or self.max_disk_bytes <= 0:
+            os.remove(synthesized_path)
+            return audio
+
+        file_path = self._file_path(key)
+        if os.path.exists(file_path):
+            self.disk_bytes -= os.path.getsize(file_path)
+        os.replace(synthesized_path, file_path)
+        self.disk_bytes += os.path.getsize(file_path)
+        if self.disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+        return audio
+
+    def _evict_disk(self):
+        files = sorted(self._disk_files(), key=lambda item: item[2])
+        self.disk_bytes = sum(size for _, size, _ in files)
+        removed = 0
+        for file_path, size, _ in files:
+            if self.disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(file_path)
+                self.disk_bytes -= size
+                removed += 1
+            except OSError as e:
+                logger.debug(f"Не удалось удалить {file_path}: {e}")
+        logger.debug(f"Из кэша озвучки удалено файлов: {removed}")
+
+    def stats(self):
+        """Счётчики попаданий (в памяти и на диске) и промахов."""
+        with self.lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "memory_bytes": self.memory_bytes,
+                "disk_bytes": self.disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (
+                    (self.hits + self.disk_hits) / total if total else 0.0
+                ),
+            }
@@ -1,7 +1,34 @@
-import numpy as np
-import scipy.signal as signal
+import os
+import sys
 from logger_setup import logger
 
+# numpy импортируется в функциях: start.py берёт отсюда пути к моделям
+# до появления окна, а numpy грузится в фоне вместе с HEAVY_MODULES
+
+
+def resource_path(relative_path):
+    """Получить абсолютный путь к ресурсу, работает в dev и с PyInstaller"""
+    try:
+        base_path = sys._MEIPASS  # type: ignore
+    except AttributeError:
+        base_path = os.path.abspath(".")
+
+    return os.path.join(base_path, relative_path)
+
+
+def get_model_path(rel_path):
+    return resource_path(rel_path)
+
+
+def get_models_paths():
+    """Пути к моделям Vosk для поддерживаемых языков."""
+    return {
+        "en": get_model_path("model_en/vosk-model-small-en-us-0.15"),
+        "fr": get_model_path("model_fr/vosk-model-small-fr-0.22"),
+        "ru": get_model_path("model_ru/vosk-model-small-ru-0.22"),
+        "zh": get_model_path("model_zh/vosk-model-small-cn-0.22"),
+    }
+
 
 def dev_to_str_dict(dev):
     """Конвертирует устройство в словарь строк."""
@@ -12,6 +39,17 @@ def dev_to_str_dict(dev):
     }
 
 
+def downmix(samples, channels):
+    """Сводит чередующиеся отсчёты channels каналов в моно (среднее)."""
+    import numpy as np
+
+    if channels <= 1:
+        return samples
+    return samples.reshape(-1, channels).mean(
+        axis=1, dtype=np.float32
+    ).astype(samples.dtype)
+
+
 class AudioProcessor:
     def __init__(self, sample_rate):
         self.sample_rate = sample_rate
@@ -22,6 +60,9 @@ class AudioProcessor:
             if len(audio_data) < 10:
                 return audio_data
 
+            # scipy импортируется только здесь: он заметно замедляет запуск
+            import scipy.signal as signal
+
             nyquist = 0.5 * self.sample_rate
             low = lowcut / nyquist
             high = highcut / nyquist
@@ -39,6 +80,8 @@ class AudioProcessor:
         if len(audio_data) == 0:
             return audio_data
 
+        import numpy as np
+
         max_val = np.max(np.abs(audio_data))
         if max_val > 0:
             return audio_data / max_val
@@ -48,6 +91,9 @@ class AudioProcessor:
         """Удаляет постоянное смещение."""
         if len(audio_data) == 0:
             return audio_data
+
+        import numpy as np
+
         return audio_data - np.mean(audio_data)
 
     def preprocess_audio(self, audio_data):
@@ -55,6 +101,8 @@ class AudioProcessor:
         if len(audio_data) == 0:
             return audio_data
 
+        import numpy as np
+
         try:
             audio_array = np.frombuffer(
                 audio_data,
@@ -68,25 +116,3 @@ class AudioProcessor:
             logger.error(f"Ошибка предобработки аудио: {e}")
             return audio_data
 
-
-def test_microphone_sensitivity(device_index, sample_rate, duration=1.0):
-    """Тестирует чувствительность микрофона."""
-    try:
-        import sounddevice as sd
-        recording = sd.rec(
-            int(duration * sample_rate),
-            samplerate=sample_rate,
-            channels=1,
-            device=device_index,
-            dtype='float32'
-        )
-        sd.wait()
-
-        if recording.size > 0:
-            rms = np.sqrt(np.mean(recording**2))
-            return float(rms)
-        return 0.0
-
-    except Exception as e:
-        logger.debug(f"Ошибка тестирования чувствительности: {e}")
-        return 0.0
@@ -0,0 +1,170 @@
+from collections import deque
+
+import numpy as np
+
+# Длина кадра анализа
+FRAME_SECONDS = 0.02
+# Шипение: много пересечений нуля ниже порога — не продолжение речи
+NOISE_ZCR = 0.35
+# Гистерезис: речь продолжается, пока RMS выше доли порога
+RELEASE_FACTOR = 0.6
+
+
+def mean_square(samples, scratch=None):
+    """Средний квадрат отсчётов int16 без переполнения.
+
+    Квадраты int16 не помещаются в int16, поэтому считаем в float32;
+    scratch — необязательный буфер float32 для работы без выделений.
+    """
+    frames = len(samples)
+    if frames == 0:
+        return 0.0
+    if scratch is None or len(scratch) < frames:
+        values = np.asarray(samples, dtype=np.float32)
+    else:
+        values = scratch[:frames]
+        np.copyto(values, samples)
+    return float(np.dot(values, values)) / frames
+
+
+class VoiceActivityDetector:
+    """Детектор речи по кадрам: энергия, пересечения нуля, удержание.
+
+    Блок делится на кадры по 20 мс, всё считается векторно. Кадр
+    речевой, если его RMS (в долях полной шкалы) не ниже порога, или
+    не ниже RELEASE_FACTOR порога сразу после речи (гистерезис) и это
+    не шипение. Шипение проверяется только ниже порога: речь на фоне
+    громкого шума (вентилятор, улица) не отбрасывается. После
+    последнего речевого кадра детектор ещё hangover_seconds считает
+    вход активным, чтобы не обрезать окончания слов. Неполный кадр
+    в конце блока переносится в следующий вызов.
+    """
+
+    def __init__(self, sample_rate, threshold=0.01, hangover_seconds=0.3,
+                 padding_seconds=0.2):
+        self.frame_length = max(1, int(FRAME_SECONDS * sample_rate))
+        self.hangover_frames = int(
+            round(hangover_seconds / FRAME_SECONDS)
+        )
+        self.padding_frames = int(round(padding_seconds / FRAME_SECONDS))
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self.remainder = np.zeros(0, dtype=np.int16)
+        self.in_speech = False
+        self.hangover_left = 0
+        self.frames_since_speech = None
+        self.padding = deque(maxlen=max(1, self.padding_frames))
+
+    def _split(self, samples):
+        """Полные кадры блока (с остатком прошлого вызова)."""
+        samples = np.concatenate(
+            (self.remainder, np.asarray(samples, dtype=np.int16))
+        )
+        count = len(samples) // self.frame_length
+        used = count * self.frame_length
+        self.remainder = samples[used:].copy()
+        return samples[:used].reshape(count, self.frame_length)
+
+    def frame_rms(self, frames):
+        """RMS каждого кадра в долях полной шкалы."""
+        values = frames.astype(np.float32)
+        return np.sqrt(
+            np.einsum("ij,ij->i", values, values) / self.frame_length
+        ) / 32768.0
+
+    def zero_crossing_rate(self, frames):
+        """Доля пересечений нуля для каждого кадра."""
+        signs = np.signbit(frames)
+        return np.count_nonzero(
+            signs[:, 1:] != signs[:, :-1], axis=1
+        ) / self.frame_length
+
+    def _classify(self, samples):
+        """Кадры блока, признак речи и маска активных кадров.
+
+        Гистерезис и удержание зависят от предыдущих кадров; вместо
+        цикла по кадрам они выражаются через индексы последнего
+        громкого, последнего тихого и последнего речевого кадра
+        (np.maximum.accumulate), состояние переходит между блоками.
+        """
+        frames = self._split(samples)
+        count = len(frames)
+        if count == 0:
+            return frames, False, np.zeros(0, dtype=bool)
+        rms = self.frame_rms(frames)
+        loud = rms >= self.threshold
+        sustained = rms >= self.threshold * RELEASE_FACTOR
+        # Пересечения нуля нужны только кадрам между порогами: громкие
+        # речевые всегда, тихие — никогда
+        band = sustained & ~loud
+        if band.any():
+            sustained[band] = (
+                self.zero_crossing_rate(frames[band]) <= NOISE_ZCR
+            )
+
+        index = np.arange(count)
+        # Речь длится от громкого кадра до первого кадра ниже гистерезиса;
+        # речь в конце прошлого блока — «громкий кадр» с индексом -1
+        last_loud = np.maximum.accumulate(
+            np.where(loud, index, -1 if self.in_speech else -2)
+        )
+        last_quiet = np.maximum.accumulate(
+            np.where(sustained, -2, index)
+        )
+        speech = sustained & (last_loud > last_quiet)
+
+        # Удержание: тихий кадр активен, если после речи прошло не больше
+        # hangover_frames кадров; остаток удержания прошлого блока —
+        # речевой кадр до начала этого блока
+        carried = self.hangover_left - self.hangover_frames - 1
+        last_speech = np.maximum.accumulate(
+            np.where(speech, index, carried)
+        )
+        active = speech | (index - last_speech <= self.hangover_frames)
+
+        voiced = bool(speech.any())
+        since_last = count - 1 - int(last_speech[-1])
+        self.in_speech = bool(speech[-1])
+        self.hangover_left = max(0, self.hangover_frames - since_last)
+        if voiced:
+            self.frames_since_speech = since_last
+        elif self.frames_since_speech is not None:
+            self.frames_since_speech += count
+        return frames, voiced, active
+
+    def process(self, samples):
+        """Обрабатывает блок int16.
+
+        Возвращает (voiced, active): voiced — в блоке есть речевые кадры,
+        active — речь или ещё идёт удержание после неё.
+        """
+        _, voiced, active = self._classify(samples)
+        return voiced, bool(active.any())
+
+    def gate(self, samples):
+        """Оставляет из блока только речь с подкладкой.
+
+        Возвращает (voiced, bytes): активные кадры, а перед началом речи —
+        до padding_seconds предшествующей тишины. Тишина вне удержания
+        отбрасывается.
+        """
+        frames, voiced, active = self._classify(samples)
+        kept = []
+        for frame, is_active in zip(frames, active):
+            if is_active:
+                kept.extend(self.padding)
+                self.padding.clear()
+                kept.append(frame)
+            elif self.padding_frames:
+                self.padding.append(frame)
+        if not kept:
+            return voiced, b""
+        return voiced, np.concatenate(kept).tobytes()
+
+    def silence_seconds(self):
+        """Сколько секунд прошло после последнего речевого кадра."""
+        if self.frames_since_speech is None:
+            return None
+        return self.frames_since_speech * FRAME_SECONDS